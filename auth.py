@@ -1,12 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from functools import lru_cache
+from fastapi import APIRouter, HTTPException, Depends, Request, status
 from sqlalchemy.orm import Session
-from jose import jwt, JWTError
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 
-from desafio_lu_estilo.database import get_db
+from desafio_lu_estilo.database import get_db, current_tenant, read_session, tenancy_enabled
 from desafio_lu_estilo.models import UserORM, UserCreate, Token
+from desafio_lu_estilo.tenancy import TENANT_CLAIM
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 # Configurações
@@ -14,25 +14,47 @@ SECRET_KEY = "minha_chave_secreta_super_segura"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-# Hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashing (passlib/bcrypt e python-jose são importados só no primeiro uso, para acelerar o boot)
+@lru_cache(maxsize=1)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
 # Funções auxiliares
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
+    from jose import jwt
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def _token_claims(username: str, tenant: str | None) -> dict:
+    # No modo multi-tenant o token carrega a loja; get_db usa essa claim para escolher o banco
+    claims = {"sub": username}
+    if tenant:
+        claims[TENANT_CLAIM] = tenant
+    return claims
+
+def token_subject(token: str) -> str | None:
+    """
+    Retorna o usuário (`sub`) de um token válido, ou None se o token for inválido.
+    """
+    from jose import jwt, JWTError
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
 def verify_user(db: Session, username: str, password: str):
     user = db.query(UserORM).filter_by(username=username).first()
     if not user or not verify_password(password, user.hashed_password):
@@ -41,15 +63,21 @@ def verify_user(db: Session, username: str, password: str):
 
 # Endpoints
 @router.post("/login", response_model=Token, summary="Login do usuário")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = verify_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais inválidas")
-    access_token = create_access_token(data={"sub": user.username})
+    access_token = create_access_token(data=_token_claims(user.username, current_tenant(request)))
     return Token(access_token=access_token, token_type="bearer")
 
 @router.post("/register", status_code=201, summary="Registrar novo usuário", response_model=dict)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+def register(user: UserCreate, db: Session = Depends(get_db), token: str | None = Depends(optional_oauth2_scheme)):
+    # No modo multi-loja, só um administrador da própria loja cadastra usuários
+    if tenancy_enabled():
+        if not token:
+            raise HTTPException(status_code=401, detail="Não autenticado")
+        if not _user_from_token(db, token).is_admin:
+            raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     if db.query(UserORM).filter_by(username=user.username).first():
         raise HTTPException(status_code=400, detail="Usuário já existe")
     db_user = UserORM(
@@ -65,6 +93,7 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
 
 @router.post("/refresh-token", response_model=Token, summary="Gerar novo token JWT")
 def refresh_token(token: str = Depends(oauth2_scheme)):
+    from jose import jwt, JWTError
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
@@ -73,20 +102,26 @@ def refresh_token(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise HTTPException(status_code=401, detail="Token inválido")
 
-    new_token = create_access_token(data={"sub": username})
+    new_token = create_access_token(data=_token_claims(username, payload.get(TENANT_CLAIM)))
     return Token(access_token=new_token, token_type="bearer")
 
+def _user_from_token(db: Session, token: str) -> UserORM:
+    username = token_subject(token)
+    user = db.query(UserORM).filter_by(username=username).first() if username else None
+    if user is None:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    return user
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> UserORM:
-    credentials_exception = HTTPException(status_code=401, detail="Token inválido")
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    return _user_from_token(db, token)
 
-    user = db.query(UserORM).filter_by(username=username).first()
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+def get_current_user_released(request: Request, token: str = Depends(oauth2_scheme)) -> UserORM:
+    """
+    Autentica com uma sessão própria, fechada antes do retorno. Usada por rotas de
+    longa duração (long-poll, SSE) para não manter uma conexão do pool durante a espera.
+    """
+    db = read_session(current_tenant(request))
+    try:
+        return _user_from_token(db, token)
+    finally:
+        db.close()
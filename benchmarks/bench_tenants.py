@@ -0,0 +1,112 @@
+"""
+Benchmark do modo multi-tenant (um arquivo SQLite por loja).
+
+Abre N tenants, mede a memória por engine aberta e a latência de
+GET /products/ distribuindo as requisições entre os tenants.
+
+    PYTHONPATH=.. python benchmarks/bench_tenants.py --tenants 1000 --requests 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tenants", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=20, help="Produtos por tenant")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="lu_estilo_tenants_")
+    # Precisa ser definido antes de importar a aplicação
+    os.environ.update({
+        "TENANCY_MODE": "database",
+        "TENANT_DB_DIR": os.path.join(workdir, "tenants"),
+        "TENANT_MAX_ENGINES": str(args.tenants + 1),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'control.db')}",
+    })
+
+    from fastapi.testclient import TestClient
+    from desafio_lu_estilo.auth import create_access_token, get_password_hash
+    from desafio_lu_estilo.database import Base, engine
+    from desafio_lu_estilo.main import app
+    from desafio_lu_estilo.models import ProductORM, UserORM
+    from desafio_lu_estilo.tenancy import registry
+
+    Base.metadata.create_all(bind=engine)
+    hashed_password = get_password_hash("senha123")
+    tenants = [f"loja-{i:04d}" for i in range(args.tenants)]
+
+    # Popula os tenants (arquivos criados fora da medição de memória)
+    start = time.perf_counter()
+    for tenant in tenants:
+        registry.provision(tenant)
+        db = registry.session(tenant)
+        db.add(UserORM(username="gerente", email=f"gerente@{tenant}.com", hashed_password=hashed_password, is_admin=1))
+        db.add_all(ProductORM(
+            description=f"Produto {i}", sale_price=10.0 + i, barcode=f"{tenant}-{i}",
+            section="Geral", initial_stock=10,
+        ) for i in range(args.products))
+        db.commit()
+        db.close()
+    seed_seconds = time.perf_counter() - start
+    registry.dispose_all()
+
+    # Memória: abre todas as engines novamente, cada uma com uma conexão no pool
+    tracemalloc.start()
+    rss_before = rss_bytes()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    for tenant in tenants:
+        db = registry.session(tenant)
+        db.query(ProductORM.id).first()
+        db.close()
+    traced_per_tenant = (tracemalloc.get_traced_memory()[0] - traced_before) / args.tenants
+    rss_per_tenant = (rss_bytes() - rss_before) / args.tenants
+    tracemalloc.stop()
+
+    # Latência com todos os tenants carregados
+    client = TestClient(app)
+    headers = {t: {"Authorization": f"Bearer {create_access_token({'sub': 'gerente', 'tenant': t})}"} for t in tenants}
+    for tenant in tenants[:50]:
+        client.get("/products/", headers=headers[tenant])
+    latencies = []
+    for _ in range(args.requests):
+        tenant = random.choice(tenants)
+        start = time.perf_counter()
+        response = client.get("/products/", headers=headers[tenant])
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.text
+
+    print(f"tenants carregados:        {len(registry.open_session_factories())}")
+    print(f"tempo de criação:          {seed_seconds:.1f} s")
+    print(f"memória por tenant (RSS):  {rss_per_tenant / 1024:.1f} KiB")
+    print(f"memória por tenant (heap): {traced_per_tenant / 1024:.1f} KiB")
+    print(f"requisições:               {args.requests}")
+    print(f"latência p50:              {statistics.median(latencies):.2f} ms")
+    print(f"latência p95:              {percentile(latencies, 95):.2f} ms")
+    print(f"latência p99:              {percentile(latencies, 99):.2f} ms")
+    registry.dispose_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+from starlette.concurrency import run_in_threadpool
+
+from desafio_lu_estilo import database
+from desafio_lu_estilo.models import ChangeEvent, ChangeEventORM, ChangeFeedStateORM
+
+# Configurações
+# Eventos mais antigos que isto são removidos
+CHANGES_RETENTION_SECONDS = 7 * 24 * 60 * 60
+# Após este tempo, eventos substituídos por um mais novo da mesma entidade são compactados
+CHANGES_COMPACTION_AFTER_SECONDS = 60 * 60
+# Limite absoluto de eventos na tabela
+CHANGES_MAX_EVENTS = 100_000
+CHANGES_POLL_INTERVAL_SECONDS = 0.5
+SSE_KEEPALIVE_SECONDS = 15
+
+ENTITIES = {"clients", "products", "orders"}
+LOW_WATERMARK_HEADER = "X-Changes-Low-Watermark"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _lock_outbox(db: Session) -> None:
+    """
+    O feed supõe que os eventos são confirmados em ordem de seq: um consumidor que já
+    leu seq N+1 nunca mais lê N. O SQLite garante isso com um único escritor; em bancos
+    com escritas concorrentes, a transação bloqueia a linha de change_feed_state antes
+    de gerar seqs, e a próxima só gera os seus depois do commit desta.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        return
+    state = db.query(ChangeFeedStateORM).filter_by(id=1).with_for_update().one_or_none()
+    if state is None:
+        # Normalmente criada por upgrade_schema
+        db.add(ChangeFeedStateORM(id=1, low_watermark=0))
+        db.flush()
+
+
+def record_change(db: Session, entity: str, op: str, entity_id: int, payload: dict | None = None) -> None:
+    """
+    Adiciona um evento à outbox na mesma transação da alteração.
+    Deve ser chamada antes do commit da operação.
+    """
+    _lock_outbox(db)
+    db.add(ChangeEventORM(entity=entity, entity_id=entity_id, op=op, payload=payload, created_at=_utcnow()))
+
+
+def _raise_low_watermark(db: Session, seq: int | None) -> None:
+    if seq is None:
+        return
+    state = db.get(ChangeFeedStateORM, 1)
+    if state is None:
+        db.add(ChangeFeedStateORM(id=1, low_watermark=seq))
+    elif seq > state.low_watermark:
+        state.low_watermark = seq
+
+
+def compact_changes(db: Session) -> int:
+    """
+    Aplica compactação e retenção à outbox, mantendo a tabela limitada:
+    - eventos superados por outro mais novo da mesma entidade são removidos
+      após CHANGES_COMPACTION_AFTER_SECONDS;
+    - eventos mais antigos que CHANGES_RETENTION_SECONDS são removidos;
+    - acima de CHANGES_MAX_EVENTS, os mais antigos são descartados.
+    Retenção e limite avançam o low watermark (ver low_watermark). A compactação
+    não avança: o evento mais novo de cada entidade continua no feed.
+    Executada periodicamente pelo agendador; não faz commit.
+    """
+    now = _utcnow()
+    newer = aliased(ChangeEventORM)
+    superseded = (
+        db.query(newer.seq)
+        .filter(newer.entity == ChangeEventORM.entity, newer.entity_id == ChangeEventORM.entity_id, newer.seq > ChangeEventORM.seq)
+        .exists()
+    )
+    removed = db.query(ChangeEventORM).filter(
+        ChangeEventORM.created_at < now - timedelta(seconds=CHANGES_COMPACTION_AFTER_SECONDS),
+        superseded,
+    ).delete(synchronize_session=False)
+
+    expired = db.query(ChangeEventORM).filter(ChangeEventORM.created_at < now - timedelta(seconds=CHANGES_RETENTION_SECONDS))
+    _raise_low_watermark(db, expired.with_entities(func.max(ChangeEventORM.seq)).scalar())
+    removed += expired.delete(synchronize_session=False)
+
+    max_seq = db.query(func.max(ChangeEventORM.seq)).scalar()
+    if max_seq is not None:
+        overflow = db.query(ChangeEventORM).filter(ChangeEventORM.seq <= max_seq - CHANGES_MAX_EVENTS)
+        _raise_low_watermark(db, overflow.with_entities(func.max(ChangeEventORM.seq)).scalar())
+        removed += overflow.delete(synchronize_session=False)
+    return removed
+
+
+def low_watermark(tenant: str | None = None) -> int:
+    """
+    Maior seq removido por retenção ou pelo limite de eventos. Consumidores com
+    `since` abaixo deste valor podem ter perdido eventos e precisam ressincronizar.
+    """
+    db = database.read_session(tenant)
+    try:
+        state = db.get(ChangeFeedStateORM, 1)
+        return state.low_watermark if state else 0
+    finally:
+        db.close()
+
+
+def fetch_changes(since: int, limit: int, entity: str | None = None, tenant: str | None = None) -> list[dict]:
+    """
+    Lê um lote de eventos com seq > since, em ordem crescente.
+    """
+    db = database.read_session(tenant)
+    try:
+        query = db.query(ChangeEventORM).filter(ChangeEventORM.seq > since)
+        if entity:
+            query = query.filter(ChangeEventORM.entity == entity)
+        events = query.order_by(ChangeEventORM.seq).limit(limit).all()
+        return [ChangeEvent.model_validate(e).model_dump(mode="json") for e in events]
+    finally:
+        db.close()
+
+
+async def wait_for_changes(since: int, limit: int, entity: str | None, timeout: float, tenant: str | None = None) -> list[dict]:
+    """
+    Long-poll: aguarda até `timeout` segundos por eventos novos.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        events = await run_in_threadpool(fetch_changes, since, limit, entity, tenant)
+        if events or time.monotonic() >= deadline:
+            return events
+        await asyncio.sleep(min(CHANGES_POLL_INTERVAL_SECONDS, max(deadline - time.monotonic(), 0)))
+
+
+async def stream_changes(request, since: int, limit: int, entity: str | None, timeout: float, tenant: str | None = None):
+    """
+    Gera eventos no formato Server-Sent Events. A conexão é encerrada após
+    `timeout` segundos; o cliente reconecta enviando Last-Event-ID.
+    """
+    deadline = time.monotonic() + timeout
+    last_sent = time.monotonic()
+    yield f"retry: {int(CHANGES_POLL_INTERVAL_SECONDS * 1000)}\n\n"
+    while not await request.is_disconnected():
+        events = await run_in_threadpool(fetch_changes, since, limit, entity, tenant)
+        for event in events:
+            since = event["seq"]
+            yield f"id: {since}\nevent: change\ndata: {json.dumps(event)}\n\n"
+        if events:
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+            last_sent = time.monotonic()
+            yield ": keepalive\n\n"
+        if time.monotonic() >= deadline:
+            break
+        if len(events) < limit:
+            await asyncio.sleep(CHANGES_POLL_INTERVAL_SECONDS)
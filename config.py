@@ -0,0 +1,23 @@
+import os
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Settings:
+    """
+    Configurações da aplicação usadas por `create_app`.
+    """
+    log_dir: str = "logs"
+    create_tables: bool = True
+    cors_origins: list[str] = field(default_factory=lambda: ["*"])
+    scheduler_enabled: bool = True
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        origins = os.getenv("CORS_ORIGINS")
+        return cls(
+            log_dir=os.getenv("LOG_DIR", "logs"),
+            create_tables=os.getenv("CREATE_TABLES", "1") != "0",
+            cors_origins=[o.strip() for o in origins.split(",") if o.strip()] if origins else ["*"],
+            scheduler_enabled=os.getenv("SCHEDULER_ENABLED", "1") != "0",
+        )
@@ -1,20 +1,276 @@
 # database.py
-from sqlalchemy import create_engine
+import logging
+import os
+import threading
+import time
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import Column, Float, Integer, Table, create_engine, event, inspect, select, text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./lu_estilo.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./lu_estilo.db")
+# "single": um único banco (padrão); "database": um arquivo SQLite por tenant (ver tenancy.py)
+TENANCY_MODE = os.getenv("TENANCY_MODE", "single")
+# Réplicas de leitura separadas por vírgula (ex.: "sqlite:///./replica1.db,sqlite:///./replica2.db")
+READ_REPLICA_URLS = [url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()]
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Após uma escrita, o mesmo cliente lê do primário por esta janela (read-your-writes)
+PRIMARY_STICKINESS_SECONDS = 5
+PRIMARY_STICKINESS_COOKIE = "lu_primary_until"
+# Réplicas com atraso maior que este são ignoradas
+MAX_REPLICA_LAG_SECONDS = 2.0
+REPLICA_HEALTH_CHECK_INTERVAL_SECONDS = 1.0
+HEARTBEAT_INTERVAL_SECONDS = 0.5
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _create_engine(url: str):
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    return create_engine(url, connect_args=connect_args)
+
+
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
-def get_db():
+# Linha única atualizada pelo primário; nas réplicas indica até onde a replicação chegou
+replication_heartbeat = Table(
+    "replication_heartbeat",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("updated_at", Float, nullable=False),
+)
+
+
+# Colunas adicionadas a tabelas já existentes: create_all não altera tabelas criadas
+# por versões anteriores, então upgrade_schema as inclui com ALTER TABLE
+ADDED_COLUMNS = {
+    "products": ["image_hash", "expired"],
+}
+
+
+# Ajustes de dados aplicados a cada startup (idempotentes)
+BACKFILLS = [
+    # Linha de change_feed_state bloqueada pela outbox em bancos com escritas concorrentes
+    "INSERT INTO change_feed_state (id, low_watermark) SELECT 1, 0 "
+    "WHERE NOT EXISTS (SELECT 1 FROM change_feed_state WHERE id = 1)",
+    # Emails de clientes passaram a ser gravados em minúsculas. Uma linha cuja versão em
+    # minúsculas já existe é mantida: a busca pelo email normalizado encontra a outra
+    "UPDATE clients SET email = lower(trim(email)) WHERE email != lower(trim(email)) "
+    "AND NOT EXISTS (SELECT 1 FROM clients AS other WHERE other.email = lower(trim(clients.email)) AND other.id != clients.id)",
+]
+
+
+def upgrade_schema(bind) -> list[str]:
+    """
+    Cria as tabelas que faltam, adiciona as colunas de ADDED_COLUMNS que ainda
+    não existem e aplica BACKFILLS. Idempotente; executada no startup.
+    Retorna as colunas adicionadas.
+    """
+    Base.metadata.create_all(bind=bind)
+    added = []
+    with bind.begin() as conn:
+        inspector = inspect(conn)
+        for table_name, column_names in ADDED_COLUMNS.items():
+            table = Base.metadata.tables[table_name]
+            existing = {column["name"] for column in inspector.get_columns(table_name)}
+            for name in column_names:
+                if name in existing:
+                    continue
+                column = table.c[name]
+                ddl = f"ALTER TABLE {table_name} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" DEFAULT {column.default.arg!r}"
+                conn.execute(text(ddl))
+                added.append(f"{table_name}.{name}")
+            if added:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+        for statement in BACKFILLS:
+            conn.execute(text(statement))
+    return added
+
+
+@event.listens_for(ReadSessionLocal, "before_flush")
+def _block_writes(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        raise RuntimeError("Sessão somente leitura não aceita escritas")
+
+
+def _read_heartbeat(bind) -> float | None:
+    with bind.connect() as conn:
+        return conn.execute(select(replication_heartbeat.c.updated_at).where(replication_heartbeat.c.id == 1)).scalar()
+
+
+_last_heartbeat = 0.0
+
+
+def write_heartbeat(force: bool = False) -> None:
+    """
+    Registra no primário o instante da última escrita, usado para medir o atraso das réplicas.
+    Chamada após requisições de escrita e após os jobs do agendador; sem réplicas não faz nada.
+    """
+    global _last_heartbeat
+    if not replica_picker.engines:
+        return
+    now = time.time()
+    if not force and now - _last_heartbeat < HEARTBEAT_INTERVAL_SECONDS:
+        return
+    _last_heartbeat = now
+    try:
+        with engine.begin() as conn:
+            updated = conn.execute(replication_heartbeat.update().where(replication_heartbeat.c.id == 1).values(updated_at=now))
+            if updated.rowcount == 0:
+                conn.execute(replication_heartbeat.insert().values(id=1, updated_at=now))
+    except SQLAlchemyError as exc:
+        logger.error(f"Falha ao gravar o heartbeat de replicação: {exc}")
+
+
+class ReplicaPicker:
+    """
+    Escolhe uma réplica saudável em round-robin, ignorando réplicas
+    indisponíveis ou com atraso acima de `max_lag`. Sem réplicas
+    saudáveis, as leituras caem para o primário.
+    """
+
+    def __init__(self, urls: list[str], max_lag: float = MAX_REPLICA_LAG_SECONDS):
+        self.engines = [_create_engine(url) for url in urls]
+        self.max_lag = max_lag
+        self._healthy = list(self.engines)
+        self._checked_at = 0.0
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        healthy = []
+        try:
+            primary_ts = _read_heartbeat(engine)
+        except SQLAlchemyError:
+            primary_ts = None
+        for replica in self.engines:
+            try:
+                replica_ts = _read_heartbeat(replica)
+            except SQLAlchemyError:
+                continue
+            if primary_ts is not None and (replica_ts is None or primary_ts - replica_ts > self.max_lag):
+                continue
+            healthy.append(replica)
+        self._healthy = healthy
+        self._checked_at = time.monotonic()
+
+    def pick(self):
+        if not self.engines:
+            return engine
+        with self._lock:
+            if time.monotonic() - self._checked_at > REPLICA_HEALTH_CHECK_INTERVAL_SECONDS:
+                self.refresh()
+            if not self._healthy:
+                return engine
+            self._index = (self._index + 1) % len(self._healthy)
+            return self._healthy[self._index]
+
+    def dispose(self) -> None:
+        for replica in self.engines:
+            replica.dispose()
+
+
+replica_picker = ReplicaPicker(READ_REPLICA_URLS)
+
+
+def configure_replicas(urls: list[str], max_lag: float = MAX_REPLICA_LAG_SECONDS) -> ReplicaPicker:
+    """
+    Substitui as réplicas de leitura em tempo de execução (útil em testes).
+    """
+    global replica_picker
+    replica_picker.dispose()
+    replica_picker = ReplicaPicker(urls, max_lag=max_lag)
+    return replica_picker
+
+
+def _is_sticky(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(PRIMARY_STICKINESS_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def tenancy_enabled() -> bool:
+    return TENANCY_MODE == "database"
+
+
+def current_tenant(request: Request) -> str | None:
+    """
+    Tenant da requisição quando o modo multi-tenant está ativo (None caso contrário).
+    """
+    if not tenancy_enabled():
+        return None
+    from desafio_lu_estilo.tenancy import tenant_from_request
+    tenant = tenant_from_request(request)
+    if tenant is None:
+        raise HTTPException(status_code=400, detail="Tenant não informado")
+    return tenant
+
+
+def read_session(tenant: str | None = None):
+    """
+    Sessão de leitura fora do ciclo de uma dependência (ex.: streaming).
+    """
+    if tenant is not None:
+        from desafio_lu_estilo.tenancy import registry
+        return registry.session(tenant)
+    return ReadSessionLocal(bind=replica_picker.pick())
+
+
+def maintenance_sessions():
+    """
+    Fábricas de sessão usadas pelos jobs: o banco principal e, no modo
+    multi-tenant, cada tenant provisionado em TENANT_DB_DIR, abertos um de cada
+    vez. Não depende das engines abertas neste processo: tenants atendidos por
+    outros workers ou fechados por ociosidade também recebem a manutenção.
+    """
+    yield "default", SessionLocal
+    if tenancy_enabled():
+        from desafio_lu_estilo.tenancy import registry
+        for tenant in registry.tenants():
+            yield tenant, registry.maintenance_session_factory(tenant)
+
+
+def get_db(request: Request = None, response: Response = None):
+    # Multi-tenant: cada loja tem seu próprio arquivo (sem réplicas de leitura)
+    tenant = current_tenant(request) if request is not None else None
+    if tenant is not None:
+        from desafio_lu_estilo.tenancy import registry
+        db = registry.session(tenant)
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+
+    # Leituras (GET) sem escrita recente do cliente vão para uma réplica em sessão somente leitura
+    if request is not None and request.method in SAFE_METHODS and not _is_sticky(request):
+        db = ReadSessionLocal(bind=replica_picker.pick())
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+
+    if request is not None and request.method not in SAFE_METHODS and response is not None:
+        sticky_until = time.time() + PRIMARY_STICKINESS_SECONDS
+        response.set_cookie(PRIMARY_STICKINESS_COOKIE, f"{sticky_until:.3f}", max_age=PRIMARY_STICKINESS_SECONDS, httponly=True)
+
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+        if request is not None and request.method not in SAFE_METHODS:
+            write_heartbeat()
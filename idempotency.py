@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from desafio_lu_estilo import database
+from desafio_lu_estilo.auth import token_subject
+from desafio_lu_estilo.models import IdempotencyKeyORM
+
+# Configurações
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_KEY_MAX_LENGTH = 180
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TIMEOUT_SECONDS = 60
+IDEMPOTENCY_WAIT_TIMEOUT_SECONDS = 30
+IDEMPOTENCY_POLL_INTERVAL_SECONDS = 0.05
+
+# Rotas cujo POST pode ser repetido com segurança via Idempotency-Key
+IDEMPOTENT_ROUTES = {
+    ("POST", "/clients/"),
+    ("POST", "/products/"),
+    ("POST", "/orders/"),
+}
+
+# Respostas de autenticação, permissão e validação do payload não são memorizadas:
+# são produzidas antes do handler executar, e a nova tentativa deve ser avaliada de novo
+UNCACHEABLE_STATUS_CODES = {401, 403, 422}
+
+STATUS_PROCESSING = "processing"
+STATUS_COMPLETED = "completed"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def hash_request(method: str, path: str, body: bytes) -> str:
+    """
+    Gera a impressão digital da requisição usada para detectar reuso
+    da mesma chave com um payload diferente.
+    """
+    digest = hashlib.sha256()
+    digest.update(method.encode())
+    digest.update(b"\0")
+    digest.update(path.encode())
+    digest.update(b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def scoped_key(key: str, subject: str, tenant: str | None = None) -> str:
+    """
+    Isola a chave por loja e por usuário autenticado: a mesma Idempotency-Key
+    enviada por outro usuário não acessa a resposta armazenada.
+    """
+    return hashlib.sha256(f"{tenant or ''}\0{subject}\0{key}".encode()).hexdigest()
+
+
+def _request_subject(request: Request) -> str | None:
+    authorization = request.headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    return token_subject(authorization[7:])
+
+
+def purge_expired_keys(db) -> int:
+    """
+    Remove as chaves cujo TTL expirou. Retorna a quantidade removida.
+    Executada periodicamente pelo agendador.
+    """
+    removed = db.query(IdempotencyKeyORM).filter(IdempotencyKeyORM.expires_at <= _utcnow()).delete()
+    db.commit()
+    return removed
+
+
+def _snapshot(record: IdempotencyKeyORM) -> dict:
+    return {
+        "request_hash": record.request_hash,
+        "status": record.status,
+        "status_code": record.status_code,
+        "content_type": record.content_type,
+        "response_body": record.response_body,
+    }
+
+
+def claim_key(key: str, request_hash: str) -> dict | None:
+    """
+    Tenta reservar a chave para esta execução.
+    Retorna None se a reserva foi obtida, senão o registro existente.
+    """
+    db = database.SessionLocal()
+    try:
+        now = _utcnow()
+        record = db.get(IdempotencyKeyORM, key)
+        if record and (record.expires_at <= now or (record.status == STATUS_PROCESSING and record.locked_until <= now)):
+            # Chave expirada ou execução anterior abandonada: pode ser reaproveitada
+            db.delete(record)
+            db.commit()
+            record = None
+
+        if record is None:
+            db.add(IdempotencyKeyORM(
+                key=key,
+                request_hash=request_hash,
+                status=STATUS_PROCESSING,
+                created_at=now,
+                locked_until=now + timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT_SECONDS),
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+            ))
+            try:
+                db.commit()
+                return None
+            except IntegrityError:
+                # Outra requisição reservou a chave primeiro
+                db.rollback()
+                record = db.get(IdempotencyKeyORM, key)
+                if record is None:
+                    return {"request_hash": request_hash, "status": STATUS_PROCESSING}
+
+        return _snapshot(record)
+    finally:
+        db.close()
+
+
+def store_response(key: str, status_code: int, content_type: str | None, body: bytes) -> None:
+    db = database.SessionLocal()
+    try:
+        db.query(IdempotencyKeyORM).filter_by(key=key).update({
+            IdempotencyKeyORM.status: STATUS_COMPLETED,
+            IdempotencyKeyORM.status_code: status_code,
+            IdempotencyKeyORM.content_type: content_type,
+            IdempotencyKeyORM.response_body: body,
+        })
+        db.commit()
+    finally:
+        db.close()
+
+
+def release_key(key: str) -> None:
+    db = database.SessionLocal()
+    try:
+        db.query(IdempotencyKeyORM).filter_by(key=key, status=STATUS_PROCESSING).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def _replay(record: dict) -> Response:
+    return Response(
+        content=record["response_body"],
+        status_code=record["status_code"],
+        media_type=record["content_type"],
+        headers={REPLAY_HEADER: "true"},
+    )
+
+
+class IdempotencyMiddleware(BaseHTTPMiddleware):
+    """
+    Garante que POSTs repetidos com o mesmo Idempotency-Key sejam executados
+    uma única vez. Requisições concorrentes aguardam a primeira execução e
+    repetições são servidas direto do armazenamento, sem escrita no banco.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or (request.method, request.url.path) not in IDEMPOTENT_ROUTES:
+            return await call_next(request)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return JSONResponse(status_code=400, content={"detail": "Idempotency-Key inválido"})
+
+        # Sem token válido a requisição segue sem idempotência e é rejeitada pela autenticação
+        subject = _request_subject(request)
+        if subject is None:
+            return await call_next(request)
+
+        # No modo multi-tenant as chaves são isoladas também por loja
+        try:
+            tenant = database.current_tenant(request)
+        except HTTPException as exc:
+            return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+        key = scoped_key(key, subject, tenant)
+
+        request_hash = hash_request(request.method, request.url.path, await request.body())
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT_SECONDS
+        while True:
+            record = await run_in_threadpool(claim_key, key, request_hash)
+            if record is None:
+                break
+            if record["request_hash"] != request_hash:
+                return JSONResponse(status_code=422, content={"detail": "Idempotency-Key já utilizado com outra requisição"})
+            if record["status"] == STATUS_COMPLETED:
+                return _replay(record)
+            if time.monotonic() >= deadline:
+                return JSONResponse(status_code=409, content={"detail": "Requisição com este Idempotency-Key ainda em processamento"})
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL_SECONDS)
+
+        try:
+            response = await call_next(request)
+            body = b"".join([chunk async for chunk in response.body_iterator])
+        except Exception:
+            await run_in_threadpool(release_key, key)
+            raise
+
+        if response.status_code >= 500 or response.status_code in UNCACHEABLE_STATUS_CODES:
+            # Falhas do servidor e rejeições anteriores ao handler não são memorizadas: o cliente pode tentar novamente
+            await run_in_threadpool(release_key, key)
+        else:
+            await run_in_threadpool(store_response, key, response.status_code, response.headers.get("content-type"), body)
+
+        return Response(content=body, status_code=response.status_code, headers=response.headers)
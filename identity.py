@@ -0,0 +1,87 @@
+import re
+from functools import lru_cache
+from operator import mul
+from typing import Iterable
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+_NON_DIGITS = re.compile(r"[^0-9]")
+# Pesos dos dois dígitos verificadores do CPF
+_FIRST_WEIGHTS = tuple(range(10, 1, -1))
+_SECOND_WEIGHTS = tuple(range(11, 1, -1))
+_ZERO = ord("0")
+
+
+def normalize_cpf(cpf: str) -> str:
+    """
+    Remove pontuação do CPF, mantendo apenas os dígitos.
+    """
+    return _NON_DIGITS.sub("", cpf)
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def _check_digit(digits: Iterable[int], weights: tuple[int, ...]) -> int:
+    return sum(map(mul, digits, weights)) * 10 % 11 % 10
+
+
+def _checksum_ok(cpf: str) -> bool:
+    if len(cpf) != 11 or not cpf.isdigit() or cpf == cpf[0] * 11:
+        return False
+    digits = [d - _ZERO for d in cpf.encode("ascii")]
+    return _check_digit(digits, _FIRST_WEIGHTS) == digits[9] and _check_digit(digits, _SECOND_WEIGHTS) == digits[10]
+
+
+@lru_cache(maxsize=4096)
+def is_valid_cpf(cpf: str) -> bool:
+    """
+    Valida o CPF (com ou sem pontuação) pelos dígitos verificadores.
+    Resultados são memorizados: o mesmo CPF costuma ser validado várias vezes.
+    """
+    return _checksum_ok(normalize_cpf(cpf))
+
+
+def validate_cpf_batch(cpfs: Iterable[str]) -> list[bool]:
+    """
+    Valida uma lista de CPFs de uma vez, para importações em massa feitas fora da API
+    (a API valida um cliente por requisição com is_valid_cpf). Cada CPF distinto é calculado apenas uma vez, sem passar pelo cache LRU
+    (que seria invadido por valores que não se repetem).
+    """
+    normalized = [_NON_DIGITS.sub("", cpf) for cpf in cpfs]
+    results = {cpf: _checksum_ok(cpf) for cpf in set(normalized)}
+    return [results[cpf] for cpf in normalized]
+
+
+def find_identity_conflict(db: Session, cpf: str | None, email: str | None, exclude_id: int | None = None) -> str | None:
+    """
+    Procura, em uma única consulta, outro cliente com o mesmo CPF ou email.
+    Retorna "cpf", "email" ou None.
+    """
+    from desafio_lu_estilo.models import ClientORM
+
+    conditions = []
+    if cpf:
+        conditions.append(ClientORM.cpf == cpf)
+    if email:
+        conditions.append(ClientORM.email == email)
+    if not conditions:
+        return None
+
+    query = db.query(ClientORM.cpf, ClientORM.email).filter(or_(*conditions))
+    if exclude_id is not None:
+        query = query.filter(ClientORM.id != exclude_id)
+    matches = query.limit(2).all()
+    if cpf and any(match.cpf == cpf for match in matches):
+        return "cpf"
+    if matches:
+        return "email"
+    return None
+
+
+def get_client_by_cpf(db: Session, cpf: str):
+    from desafio_lu_estilo.models import ClientORM
+
+    return db.query(ClientORM).filter(ClientORM.cpf == normalize_cpf(cpf)).first()
@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+# Configurações
+# Tempo máximo que GET /media aguarda a geração de uma variante ausente
+VARIANT_WAIT_TIMEOUT_SECONDS = 15
+MEDIA_DIR = Path(os.getenv("MEDIA_DIR", "media"))
+MEDIA_URL_PREFIX = "/media"
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Variantes geradas para cada imagem: nome -> (lado máximo em px, formato Pillow)
+IMAGE_VARIANTS = {
+    "thumb.webp": (200, "WEBP"),
+    "thumb.jpg": (200, "JPEG"),
+    "medium.webp": (800, "WEBP"),
+    "medium.jpg": (800, "JPEG"),
+}
+ORIGINAL_VARIANT = "original"
+
+MEDIA_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.RLock()
+# Gerações em andamento (uma por imagem) e imagens cuja geração falhou neste processo
+_pending: dict[str, Future] = {}
+_failed: set[str] = set()
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+def image_variant_urls(digest: str | None) -> dict[str, str]:
+    """
+    Monta as URLs públicas das variantes de uma imagem a partir do seu hash.
+    """
+    if not digest:
+        return {}
+    names = [ORIGINAL_VARIANT, *IMAGE_VARIANTS]
+    return {name: f"{MEDIA_URL_PREFIX}/{digest}/{name}" for name in names}
+
+
+def original_path(digest: str, media_dir: Path | None = None) -> Path:
+    return Path(media_dir or MEDIA_DIR) / "originals" / digest[:2] / digest
+
+
+def variant_path(digest: str, variant: str, media_dir: Path | None = None) -> Path:
+    if variant == ORIGINAL_VARIANT:
+        return original_path(digest, media_dir)
+    return Path(media_dir or MEDIA_DIR) / "variants" / digest[:2] / digest / variant
+
+
+def media_type_path(digest: str, media_dir: Path | None = None) -> Path:
+    # O original é gravado sem extensão; o formato detectado no upload fica neste arquivo
+    return original_path(digest, media_dir).with_name(f"{digest}.type")
+
+
+@lru_cache(maxsize=4096)
+def _original_media_type(digest: str) -> str:
+    # Conteúdo endereçado por hash nunca muda, então o resultado pode ficar em cache
+    try:
+        return media_type_path(digest).read_text().strip()
+    except FileNotFoundError:
+        pass
+    from PIL import Image
+
+    # Originais gravados antes do arquivo de formato: detecta uma vez e registra
+    with Image.open(original_path(digest)) as img:
+        detected = MEDIA_TYPES.get(img.format, "application/octet-stream")
+    _atomic_write(media_type_path(digest), detected.encode())
+    return detected
+
+
+def media_type(digest: str, variant: str) -> str:
+    if variant != ORIGINAL_VARIANT:
+        return MEDIA_TYPES[IMAGE_VARIANTS[variant][1]]
+    return _original_media_type(digest)
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def store_original(data: bytes) -> tuple[str, str]:
+    """
+    Valida e grava a imagem original endereçada pelo seu SHA-256.
+    Retorna (hash, media type). Arquivos repetidos não são regravados.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    if len(data) > MAX_IMAGE_BYTES:
+        raise InvalidImageError("Imagem excede o tamanho máximo permitido")
+    try:
+        with Image.open(BytesIO(data)) as img:
+            image_format = img.format
+            img.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise InvalidImageError("Arquivo de imagem inválido")
+    if image_format not in MEDIA_TYPES:
+        raise InvalidImageError("Formato de imagem não suportado")
+
+    digest = hashlib.sha256(data).hexdigest()
+    path = original_path(digest)
+    if not path.exists():
+        _atomic_write(media_type_path(digest), MEDIA_TYPES[image_format].encode())
+        _atomic_write(path, data)
+    return digest, MEDIA_TYPES[image_format]
+
+
+def generate_variants(digest: str, media_dir: str) -> list[str]:
+    """
+    Gera as miniaturas e variantes WebP de uma imagem original.
+    Executada no pool de processos; variantes já existentes são mantidas.
+    """
+    from PIL import Image
+
+    generated = []
+    with Image.open(original_path(digest, media_dir)) as original:
+        original.load()
+        for name, (size, image_format) in IMAGE_VARIANTS.items():
+            path = variant_path(digest, name, media_dir)
+            if path.exists():
+                continue
+            img = original.copy()
+            img.thumbnail((size, size))
+            if image_format == "JPEG" and img.mode != "RGB":
+                img = img.convert("RGB")
+            buffer = BytesIO()
+            img.save(buffer, format=image_format, quality=85)
+            _atomic_write(path, buffer.getvalue())
+            generated.append(name)
+    return generated
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn em vez de fork: o pool é criado a partir de uma thread do servidor,
+            # e fork em processo com várias threads pode travar o filho
+            _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def variants_failed(digest: str) -> bool:
+    return digest in _failed
+
+
+def _on_variants_done(digest: str, future: Future) -> None:
+    with _pool_lock:
+        _pending.pop(digest, None)
+        if future.cancelled() or future.exception() is None:
+            return
+        _failed.add(digest)
+    logger.error(f"Falha ao gerar as variantes da imagem {digest}: {future.exception()}")
+
+
+def schedule_variants(digest: str) -> Future:
+    """
+    Agenda a geração das variantes em segundo plano e retorna o Future.
+    Pedidos simultâneos para a mesma imagem compartilham a mesma execução.
+    """
+    with _pool_lock:
+        future = _pending.get(digest)
+        if future is not None:
+            return future
+        # O diretório é passado explicitamente: os processos do pool não herdam alterações feitas em MEDIA_DIR
+        future = _pending[digest] = get_pool().submit(generate_variants, digest, str(MEDIA_DIR))
+    future.add_done_callback(lambda done: _on_variants_done(digest, done))
+    return future
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
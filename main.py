@@ -1,76 +1,65 @@
 import os
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Path as PathParam, Body, Query
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Request, Path as PathParam, Body, Query, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, func
 from pathlib import Path as FilePath
 import logging
 from logging.handlers import RotatingFileHandler
 
-from desafio_lu_estilo.database import Base, engine, get_db
+from desafio_lu_estilo.config import Settings
+from desafio_lu_estilo.database import SessionLocal, engine, get_db, current_tenant, upgrade_schema
 from desafio_lu_estilo.models import (
     ClientCreate, ClientUpdate, ClientOut, ClientORM,
     ProductCreate, ProductUpdate, Product, ProductORM,
     OrderCreate, OrderUpdate, Order, OrderORM, OrderProductORM,
-    WhatsappMessage, UserORM
+    WhatsappMessage, UserORM, ChangeBatch, SchedulerStatus
 )
-from desafio_lu_estilo.auth import router as auth_router, get_current_user, get_password_hash, oauth2_scheme
+from desafio_lu_estilo.auth import router as auth_router, get_current_user, get_current_user_released, get_password_hash, oauth2_scheme
 from desafio_lu_estilo.utils import send_whatsapp_message_to
+from desafio_lu_estilo.idempotency import IdempotencyMiddleware
+from desafio_lu_estilo import images, tenancy
+from desafio_lu_estilo import changes
+from desafio_lu_estilo.changes import record_change
+from desafio_lu_estilo.scheduler import scheduler
+from desafio_lu_estilo.identity import find_identity_conflict, get_client_by_cpf, is_valid_cpf
 
-# Logger de erros
-os.makedirs("logs", exist_ok=True)
-log_handler = RotatingFileHandler("logs/error.log", maxBytes=1000000, backupCount=5)
-log_formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
-log_handler.setFormatter(log_formatter)
 logger = logging.getLogger("uvicorn.error")
-logger.setLevel(logging.ERROR)
-logger.addHandler(log_handler)
-
-# Inicialização
-Base.metadata.create_all(bind=engine)
-app = FastAPI(
-    title="API - Lu Estilo",
-    description="API para cadastro de clientes, produtos, pedidos e envio simulado de WhatsApp.",
-    version="1.0.0"
-)
-
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+router = APIRouter()
 
 # Arquivos estáticos
 static_dir = FilePath(__file__).resolve().parent / "static"
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
-@app.get("/", include_in_schema=False)
+@router.get("/", include_in_schema=False)
 def root():
     return FileResponse(static_dir / "index.html")
 
-@app.get("/health", tags=["Status"], summary="Health Check")
+@router.get("/health", tags=["Status"], summary="Health Check")
 def health_check():
     return {"status": "ok"}
 
 # CLIENTES
-@app.post("/clients/", response_model=ClientOut, tags=["Clientes"], summary="Criar cliente")
+@router.post("/clients/", response_model=ClientOut, tags=["Clientes"], summary="Criar cliente")
 def create_client(client: ClientCreate, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
-    if db.query(ClientORM).filter_by(cpf=client.cpf).first():
+    conflict = find_identity_conflict(db, client.cpf, client.email)
+    if conflict == "cpf":
         raise HTTPException(status_code=400, detail="CPF já cadastrado")
-    if db.query(ClientORM).filter_by(email=client.email).first():
+    if conflict == "email":
         raise HTTPException(status_code=400, detail="Email já cadastrado")
     db_client = ClientORM(**client.model_dump())
     db.add(db_client)
+    db.flush()
+    record_change(db, "clients", "create", db_client.id, ClientOut.model_validate(db_client).model_dump(mode="json"))
     db.commit()
     db.refresh(db_client)
     return ClientOut.model_validate(db_client)
 
-@app.get("/clients/", response_model=list[ClientOut], tags=["Clientes"], summary="Listar clientes")
+@router.get("/clients/", response_model=list[ClientOut], tags=["Clientes"], summary="Listar clientes")
 def list_clients(skip: int = 0, limit: int = 10, name: str = Query(None), email: str = Query(None), db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     query = db.query(ClientORM)
     if name:
@@ -80,46 +69,62 @@ def list_clients(skip: int = 0, limit: int = 10, name: str = Query(None), email:
     clients = query.offset(skip).limit(limit).all()
     return [ClientOut.model_validate(client) for client in clients]
 
-@app.get("/clients/{client_id}", response_model=ClientOut, tags=["Clientes"], summary="Buscar cliente por ID")
+@router.get("/clients/lookup", response_model=ClientOut, tags=["Clientes"], summary="Buscar cliente por CPF")
+def lookup_client(cpf: str = Query(..., description="CPF com ou sem pontuação"), db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
+    if not is_valid_cpf(cpf):
+        raise HTTPException(status_code=400, detail="CPF inválido")
+    client = get_client_by_cpf(db, cpf)
+    if not client:
+        raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    return ClientOut.model_validate(client)
+
+@router.get("/clients/{client_id}", response_model=ClientOut, tags=["Clientes"], summary="Buscar cliente por ID")
 def get_client_by_id(client_id: int, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     client = db.query(ClientORM).filter_by(id=client_id).first()
     if not client:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
     return ClientOut.model_validate(client)
 
-@app.put("/clients/{id}", response_model=ClientOut, tags=["Clientes"], summary="Atualizar cliente")
+@router.put("/clients/{id}", response_model=ClientOut, tags=["Clientes"], summary="Atualizar cliente")
 def update_client(updated_data: ClientUpdate, id: int = PathParam(gt=0), db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     client = db.query(ClientORM).filter_by(id=id).first()
     if not client:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
-    if updated_data.email and updated_data.email != client.email:
-        if db.query(ClientORM).filter(ClientORM.email == updated_data.email, ClientORM.id != id).first():
-            raise HTTPException(status_code=400, detail="Email já em uso")
+    conflict = find_identity_conflict(db, updated_data.cpf, updated_data.email, exclude_id=id)
+    if conflict == "cpf":
+        raise HTTPException(status_code=400, detail="CPF já em uso")
+    if conflict == "email":
+        raise HTTPException(status_code=400, detail="Email já em uso")
     for field, value in updated_data.model_dump(exclude_unset=True).items():
         setattr(client, field, value)
+    db.flush()
+    record_change(db, "clients", "update", client.id, ClientOut.model_validate(client).model_dump(mode="json"))
     db.commit()
     db.refresh(client)
     return ClientOut.model_validate(client)
 
-@app.delete("/clients/{id}", tags=["Clientes"], summary="Deletar cliente")
+@router.delete("/clients/{id}", tags=["Clientes"], summary="Deletar cliente")
 def delete_client(id: int, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     client = db.query(ClientORM).filter_by(id=id).first()
     if not client:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
     db.delete(client)
+    record_change(db, "clients", "delete", id)
     db.commit()
     return {"detail": "Cliente deletado com sucesso"}
 
 # PRODUTOS
-@app.post("/products/", response_model=Product, tags=["Produtos"], summary="Criar produto")
+@router.post("/products/", response_model=Product, tags=["Produtos"], summary="Criar produto")
 def create_product(product: ProductCreate, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     db_product = ProductORM(**product.model_dump())
     db.add(db_product)
+    db.flush()
+    record_change(db, "products", "create", db_product.id, Product.model_validate(db_product).model_dump(mode="json"))
     db.commit()
     db.refresh(db_product)
     return Product.model_validate(db_product)
 
-@app.get("/products/", response_model=list[Product], tags=["Produtos"], summary="Listar produtos")
+@router.get("/products/", response_model=list[Product], tags=["Produtos"], summary="Listar produtos")
 def list_products(skip: int = 0, limit: int = 10, section: str = Query(None), min_price: float = Query(None), max_price: float = Query(None), available: bool = Query(None), db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     query = db.query(ProductORM)
     if section:
@@ -129,38 +134,87 @@ def list_products(skip: int = 0, limit: int = 10, section: str = Query(None), mi
     if max_price is not None:
         query = query.filter(ProductORM.sale_price <= max_price)
     if available:
-        query = query.filter(ProductORM.initial_stock > 0)
+        query = query.filter(ProductORM.initial_stock > 0, or_(ProductORM.expired == 0, ProductORM.expired.is_(None)))
     return [Product.model_validate(p) for p in query.offset(skip).limit(limit).all()]
 
-@app.get("/products/{product_id}", response_model=Product, tags=["Produtos"], summary="Buscar produto por ID")
+@router.get("/products/{product_id}", response_model=Product, tags=["Produtos"], summary="Buscar produto por ID")
 def get_product_by_id(product_id: int, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     product = db.query(ProductORM).filter_by(id=product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     return Product.model_validate(product)
 
-@app.put("/products/{product_id}", response_model=Product, tags=["Produtos"], summary="Atualizar produto")
+@router.post("/products/{product_id}/image", response_model=Product, tags=["Produtos"], summary="Enviar imagem do produto")
+def upload_product_image(product_id: int, file: UploadFile = File(...), db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
+    product = db.query(ProductORM).filter_by(id=product_id).first()
+    if not product:
+        raise HTTPException(status_code=404, detail="Produto não encontrado")
+    try:
+        digest, _ = images.store_original(file.file.read(images.MAX_IMAGE_BYTES + 1))
+    except images.InvalidImageError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    product.image_hash = digest
+    product.image_url = images.image_variant_urls(digest)[images.ORIGINAL_VARIANT]
+    db.flush()
+    record_change(db, "products", "update", product.id, Product.model_validate(product).model_dump(mode="json"))
+    db.commit()
+    db.refresh(product)
+    # Miniaturas e WebP são gerados fora da requisição
+    if not images.variants_failed(digest):
+        images.schedule_variants(digest)
+    return Product.model_validate(product)
+
+@router.get("/media/{digest}/{variant}", tags=["Produtos"], summary="Servir imagem do produto")
+async def get_product_image(request: Request, variant: str, digest: str = PathParam(pattern=r"^[0-9a-f]{64}$")):
+    if variant != images.ORIGINAL_VARIANT and variant not in images.IMAGE_VARIANTS:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    if not images.original_path(digest).exists():
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    path = images.variant_path(digest, variant)
+    if not path.exists():
+        # Geração que já falhou não é reenviada ao pool a cada requisição
+        if images.variants_failed(digest):
+            raise HTTPException(status_code=404, detail="Imagem não encontrada")
+        # Variante ainda não gerada: aguarda o pool sem bloquear o event loop
+        future = asyncio.wrap_future(images.schedule_variants(digest))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=images.VARIANT_WAIT_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Imagem em processamento", headers={"Retry-After": "5"})
+        except Exception:
+            raise HTTPException(status_code=404, detail="Imagem não encontrada")
+
+    # Arquivos endereçados por conteúdo nunca mudam: cache imutável e ETag estável
+    headers = {"Cache-Control": images.IMMUTABLE_CACHE_CONTROL, "ETag": f'"{digest}-{variant}"'}
+    if headers["ETag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=images.media_type(digest, variant), headers=headers)
+
+@router.put("/products/{product_id}", response_model=Product, tags=["Produtos"], summary="Atualizar produto")
 def update_product(product_id: int, updated_data: ProductUpdate, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     product = db.query(ProductORM).filter_by(id=product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     for field, value in updated_data.model_dump(exclude_unset=True).items():
         setattr(product, field, value)
+    db.flush()
+    record_change(db, "products", "update", product.id, Product.model_validate(product).model_dump(mode="json"))
     db.commit()
     db.refresh(product)
     return Product.model_validate(product)
 
-@app.delete("/products/{product_id}", tags=["Produtos"], summary="Deletar produto")
+@router.delete("/products/{product_id}", tags=["Produtos"], summary="Deletar produto")
 def delete_product(product_id: int, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     product = db.query(ProductORM).filter_by(id=product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     db.delete(product)
+    record_change(db, "products", "delete", product_id)
     db.commit()
     return {"detail": "Produto deletado com sucesso"}
 
 # PEDIDOS
-@app.post("/orders/", response_model=Order, tags=["Pedidos"], summary="Criar pedido")
+@router.post("/orders/", response_model=Order, tags=["Pedidos"], summary="Criar pedido")
 def create_order(order: OrderCreate, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     for product_id in order.products:
         product = db.query(ProductORM).filter_by(id=product_id).first()
@@ -171,18 +225,23 @@ def create_order(order: OrderCreate, db: Session = Depends(get_db), user: UserOR
 
     db_order = OrderORM(client_id=order.client_id, status=order.status)
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+    db.flush()
 
     for product_id in order.products:
         db.add(OrderProductORM(order_id=db_order.id, product_id=product_id, quantity=1))
         db.query(ProductORM).filter_by(id=product_id).update({ProductORM.initial_stock: ProductORM.initial_stock - 1})
 
+    # Pedido, baixa de estoque e eventos de mudança são gravados na mesma transação
+    db.flush()
+    db.refresh(db_order)
+    record_change(db, "orders", "create", db_order.id, Order.model_validate(db_order).model_dump(mode="json"))
+    for product in db.query(ProductORM).filter(ProductORM.id.in_(set(order.products))).all():
+        record_change(db, "products", "update", product.id, Product.model_validate(product).model_dump(mode="json"))
     db.commit()
     db.refresh(db_order)
     return Order.model_validate(db_order)
 
-@app.get("/orders/", response_model=list[Order], tags=["Pedidos"], summary="Listar pedidos")
+@router.get("/orders/", response_model=list[Order], tags=["Pedidos"], summary="Listar pedidos")
 def list_orders(skip: int = 0, limit: int = 10, status: str = Query(None), client_id: int = Query(None), section: str = Query(None), start_date: str = Query(None), end_date: str = Query(None), db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     query = db.query(OrderORM)
     if status:
@@ -198,14 +257,14 @@ def list_orders(skip: int = 0, limit: int = 10, status: str = Query(None), clien
     pedidos = query.offset(skip).limit(limit).all()
     return [Order.model_validate(p) for p in pedidos]
 
-@app.get("/orders/{order_id}", response_model=Order, tags=["Pedidos"], summary="Buscar pedido por ID")
+@router.get("/orders/{order_id}", response_model=Order, tags=["Pedidos"], summary="Buscar pedido por ID")
 def get_order_by_id(order_id: int, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     order = db.query(OrderORM).filter_by(id=order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Pedido não encontrado")
     return Order.model_validate(order)
 
-@app.put("/orders/{order_id}", response_model=Order, tags=["Pedidos"], summary="Atualizar pedido")
+@router.put("/orders/{order_id}", response_model=Order, tags=["Pedidos"], summary="Atualizar pedido")
 def update_order(order_id: int, updated_data: OrderUpdate = Body(...), db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     order = db.query(OrderORM).filter_by(id=order_id).first()
     if not order:
@@ -216,33 +275,144 @@ def update_order(order_id: int, updated_data: OrderUpdate = Body(...), db: Sessi
         db.query(OrderProductORM).filter_by(order_id=order.id).delete()
         for product_id in updated_data.products:
             db.add(OrderProductORM(order_id=order.id, product_id=product_id, quantity=1))
+    db.flush()
+    db.refresh(order)
+    record_change(db, "orders", "update", order.id, Order.model_validate(order).model_dump(mode="json"))
     db.commit()
     db.refresh(order)
     return Order.model_validate(order)
 
-@app.delete("/orders/{order_id}", tags=["Pedidos"], summary="Deletar pedido")
+@router.delete("/orders/{order_id}", tags=["Pedidos"], summary="Deletar pedido")
 def delete_order(order_id: int, db: Session = Depends(get_db), user: UserORM = Depends(get_current_user)):
     order = db.query(OrderORM).filter_by(id=order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Pedido não encontrado")
     db.query(OrderProductORM).filter_by(order_id=order_id).delete()
     db.delete(order)
+    record_change(db, "orders", "delete", order_id)
     db.commit()
     return {"detail": "Pedido deletado com sucesso"}
 
+# MUDANÇAS (CDC)
+@router.get("/changes", response_model=ChangeBatch, tags=["Mudanças"], summary="Feed de mudanças de clientes, produtos e pedidos")
+async def list_changes(
+    request: Request,
+    since: int = Query(0, ge=0, description="Retorna eventos com seq maior que este valor"),
+    limit: int = Query(100, ge=1, le=1000),
+    entity: str = Query(None, description="clients, products ou orders"),
+    timeout: float = Query(0, ge=0, le=300, description="Long-poll: segundos aguardando eventos novos. SSE: duração da conexão"),
+    # A espera pode durar minutos: a autenticação não deve segurar uma conexão do pool
+    user: UserORM = Depends(get_current_user_released),
+):
+    if entity and entity not in changes.ENTITIES:
+        raise HTTPException(status_code=400, detail="Entidade inválida")
+    tenant = current_tenant(request)
+    stream = "text/event-stream" in request.headers.get("accept", "")
+    last_event_id = request.headers.get("last-event-id")
+    start = int(last_event_id) if stream and last_event_id and last_event_id.isdigit() else since
+    # Eventos anteriores ao low watermark foram removidos: o consumidor precisa ressincronizar
+    low_watermark = await run_in_threadpool(changes.low_watermark, tenant)
+    if start < low_watermark:
+        raise HTTPException(
+            status_code=410,
+            detail="Eventos anteriores a `since` foram removidos; faça uma sincronização completa",
+            headers={changes.LOW_WATERMARK_HEADER: str(low_watermark)},
+        )
+    if stream:
+        return StreamingResponse(
+            changes.stream_changes(request, start, limit, entity, timeout, tenant),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+    events = await changes.wait_for_changes(since, limit, entity, timeout, tenant)
+    return ChangeBatch(events=events, next_since=events[-1]["seq"] if events else since)
+
 # WHATSAPP
-@app.post("/whatsapp/send", response_model=dict, tags=["WhatsApp"], summary="Enviar mensagem de WhatsApp")
+@router.post("/whatsapp/send", response_model=dict, tags=["WhatsApp"], summary="Enviar mensagem de WhatsApp")
 def send_whatsapp(message: WhatsappMessage, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     client = db.query(ClientORM).filter_by(id=message.client_id).first()
     if not client:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
     return send_whatsapp_message_to(client, message.message)
 
+# ADMIN
+@router.get("/admin/jobs", response_model=SchedulerStatus, tags=["Admin"], summary="Status dos jobs em segundo plano")
+def list_jobs(request: Request, user: UserORM = Depends(get_current_user)):
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
+    # scheduler_lock e scheduled_jobs ficam no banco principal, mesmo no modo multi-tenant
+    db = SessionLocal()
+    try:
+        status = scheduler.status(db)
+    finally:
+        db.close()
+    # Resultados e erros citam outras lojas: administradores de loja veem só contagens e tempos
+    if current_tenant(request) is not None:
+        for job in status["jobs"]:
+            job["last_result"] = job["last_error"] = None
+    return SchedulerStatus(**status)
+
 # Global error handler
-@app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Erro não tratado: {exc} | Path: {request.url}")
     return JSONResponse(status_code=500, content={"detail": "Erro interno do servidor. A equipe técnica foi notificada."})
 
-# Auth router
-app.include_router(auth_router, tags=["Autenticação"])
+def _setup_error_log(settings: Settings) -> RotatingFileHandler:
+    os.makedirs(settings.log_dir, exist_ok=True)
+    log_handler = RotatingFileHandler(os.path.join(settings.log_dir, "error.log"), maxBytes=1000000, backupCount=5)
+    log_handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
+    logger.setLevel(logging.ERROR)
+    logger.addHandler(log_handler)
+    return log_handler
+
+def create_app(settings: Settings | None = None) -> FastAPI:
+    """
+    Monta a aplicação. Efeitos colaterais (arquivo de log, criação das tabelas,
+    agendador de jobs) acontecem no lifespan, e não na importação do módulo.
+    """
+    settings = settings or Settings.from_env()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        log_handler = _setup_error_log(settings)
+        if settings.create_tables:
+            upgrade_schema(engine)
+        if settings.scheduler_enabled:
+            scheduler.start()
+        try:
+            yield
+        finally:
+            await scheduler.stop()
+            images.shutdown_pool()
+            tenancy.registry.dispose_all()
+            logger.removeHandler(log_handler)
+            log_handler.close()
+
+    app = FastAPI(
+        title="API - Lu Estilo",
+        description="API para cadastro de clientes, produtos, pedidos e envio simulado de WhatsApp.",
+        version="1.0.0",
+        lifespan=lifespan,
+    )
+    app.state.settings = settings
+
+    # Idempotência (registrada antes do CORS para que as repetições também recebam os cabeçalhos CORS)
+    app.add_middleware(IdempotencyMiddleware)
+
+    # CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.mount("/static", StaticFiles(directory=static_dir), name="static")
+    app.add_exception_handler(Exception, global_exception_handler)
+    app.include_router(router)
+    # Auth router
+    app.include_router(auth_router, tags=["Autenticação"])
+    return app
+
+app = create_app()
@@ -1,14 +1,13 @@
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-import re
 from fastapi import Path as PathParam, HTTPException, status
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, LargeBinary, JSON, Index
 from sqlalchemy.orm import relationship, Session
 from pydantic import BaseModel, EmailStr, field_validator, ConfigDict, Field
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 
 from desafio_lu_estilo.database import Base
+from desafio_lu_estilo.images import image_variant_urls
+from desafio_lu_estilo.identity import is_valid_cpf, normalize_cpf, normalize_email
 
 # ---------------------- CONFIGURAÇÃO JWT ----------------------
 SECRET_KEY = "sua_chave_secreta_aqui"
@@ -33,6 +32,13 @@ class ProductORM(Base):
     initial_stock = Column(Integer)
     expiration_date = Column(DateTime, nullable=True)
     image_url = Column(String, nullable=True)
+    image_hash = Column(String(64), nullable=True)
+    # Marcado pelo job periódico de expiração quando expiration_date passa
+    expired = Column(Integer, default=0, index=True)
+
+    @property
+    def image_variants(self) -> dict[str, str]:
+        return image_variant_urls(self.image_hash)
 
 class OrderORM(Base):
     __tablename__ = "orders"
@@ -59,6 +65,55 @@ class UserORM(Base):
     hashed_password = Column(String, nullable=False)
     is_admin = Column(Integer, default=0)
 
+class IdempotencyKeyORM(Base):
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status = Column(String, nullable=False, default="processing")
+    status_code = Column(Integer, nullable=True)
+    content_type = Column(String, nullable=True)
+    response_body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    locked_until = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class ChangeEventORM(Base):
+    __tablename__ = "change_events"
+    # AUTOINCREMENT no SQLite garante que números de sequência nunca são reutilizados
+    __table_args__ = (
+        Index("ix_change_events_entity_key", "entity", "entity_id", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)
+    payload = Column(JSON, nullable=True)
+    created_at = Column(DateTime, nullable=False, index=True, default=lambda: datetime.now(timezone.utc))
+
+class ChangeFeedStateORM(Base):
+    __tablename__ = "change_feed_state"
+    # Linha única; low_watermark é o maior seq já removido por retenção ou pelo limite de eventos
+    id = Column(Integer, primary_key=True)
+    low_watermark = Column(Integer, nullable=False, default=0)
+
+class SchedulerLockORM(Base):
+    __tablename__ = "scheduler_lock"
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class ScheduledJobORM(Base):
+    __tablename__ = "scheduled_jobs"
+    name = Column(String, primary_key=True)
+    runs = Column(Integer, default=0, nullable=False)
+    failures = Column(Integer, default=0, nullable=False)
+    last_started_at = Column(DateTime, nullable=True)
+    last_success_at = Column(DateTime, nullable=True)
+    last_duration_ms = Column(Float, nullable=True)
+    last_result = Column(String, nullable=True)
+    last_error = Column(String, nullable=True)
+
 # ---------------------- SCHEMAS (Pydantic) ----------------------
 class User(BaseModel):
     username: str = Field(..., example="usuario123", description="Nome de usuário")
@@ -75,17 +130,29 @@ class Token(BaseModel):
     access_token: str = Field(..., example="eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9...")
     token_type: str = Field(..., example="bearer")
 
+def _validate_cpf(value: str) -> str:
+    # CPFs são armazenados apenas com dígitos
+    cpf = normalize_cpf(value)
+    if len(cpf) != 11:
+        raise ValueError("CPF deve conter exatamente 11 dígitos")
+    if not is_valid_cpf(cpf):
+        raise ValueError("CPF inválido")
+    return cpf
+
 class ClientBase(BaseModel):
     name: str = Field(..., example="Maria da Silva", description="Nome completo do cliente")
     email: EmailStr = Field(..., example="maria@email.com", description="E-mail do cliente")
-    cpf: str = Field(..., example="12345678901", description="CPF com 11 dígitos")
+    cpf: str = Field(..., example="52998224725", description="CPF com 11 dígitos (pontuação é removida)")
 
     @field_validator("cpf")
     @classmethod
     def validate_cpf(cls, v):
-        if not re.match(r"^\d{11}$", v):
-            raise ValueError("CPF deve conter exatamente 11 dígitos")
-        return v
+        return _validate_cpf(v)
+
+    @field_validator("email")
+    @classmethod
+    def normalize_email(cls, v):
+        return normalize_email(v)
 
 class ClientCreate(ClientBase):
     pass
@@ -95,6 +162,16 @@ class ClientUpdate(BaseModel):
     email: Optional[EmailStr] = Field(None, example="novo@email.com")
     cpf: Optional[str] = Field(None, example="98765432100")
 
+    @field_validator("cpf")
+    @classmethod
+    def validate_cpf(cls, v):
+        return _validate_cpf(v) if v is not None else v
+
+    @field_validator("email")
+    @classmethod
+    def normalize_email(cls, v):
+        return normalize_email(v) if v is not None else v
+
 class ClientOut(BaseModel):
     id: int
     name: str
@@ -131,6 +208,7 @@ class ProductUpdate(BaseModel):
 
 class Product(ProductBase):
     id: int
+    image_variants: dict[str, str] = Field(default_factory=dict, example={"thumb.webp": "/media/<sha256>/thumb.webp"}, description="URLs das variantes da imagem enviada")
     model_config = ConfigDict(from_attributes=True)
 
 class OrderProductOut(BaseModel):
@@ -159,3 +237,32 @@ class Order(OrderBase):
 class WhatsappMessage(BaseModel):
     client_id: int = Field(..., description="ID do cliente que receberá a mensagem", example=1)
     message: str = Field(..., description="Conteúdo da mensagem a ser enviada", example="Olá! Seu produto já está disponível.")
+
+class ChangeEvent(BaseModel):
+    seq: int = Field(..., example=42, description="Número de sequência (crescente)")
+    entity: str = Field(..., example="orders", description="Entidade alterada: clients, products ou orders")
+    entity_id: int = Field(..., example=1)
+    op: str = Field(..., example="create", description="create, update ou delete")
+    payload: Optional[dict] = Field(None, description="Estado da entidade após a alteração")
+    created_at: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+class ChangeBatch(BaseModel):
+    events: list[ChangeEvent]
+    next_since: int = Field(..., example=42, description="Valor a ser enviado como `since` na próxima consulta")
+
+class JobStatus(BaseModel):
+    name: str = Field(..., example="expire_products")
+    interval_seconds: float = Field(..., example=300)
+    runs: int = Field(0, example=12)
+    failures: int = Field(0, example=0)
+    last_started_at: Optional[datetime] = None
+    last_success_at: Optional[datetime] = None
+    last_duration_ms: Optional[float] = Field(None, example=3.2)
+    last_result: Optional[str] = Field(None, example="2")
+    last_error: Optional[str] = None
+
+class SchedulerStatus(BaseModel):
+    leader: Optional[str] = Field(None, description="Processo que detém o lock do agendador")
+    is_leader: bool = Field(False, description="Se este processo é o líder")
+    jobs: list[JobStatus]
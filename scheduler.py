@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from sqlalchemy import or_, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from desafio_lu_estilo import database, tenancy
+from desafio_lu_estilo.changes import compact_changes, record_change
+from desafio_lu_estilo.idempotency import purge_expired_keys
+from desafio_lu_estilo.models import Product, ProductORM, ScheduledJobORM, SchedulerLockORM
+
+# Configurações
+SCHEDULER_LOCK_NAME = "scheduler"
+SCHEDULER_LEASE_SECONDS = 30
+SCHEDULER_TICK_SECONDS = 1.0
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ---------------------- JOBS ----------------------
+def expire_products(db: Session) -> int:
+    """
+    Marca como vencidos os produtos cuja data de validade já passou.
+    """
+    now = _utcnow()
+    products = db.query(ProductORM).filter(
+        ProductORM.expiration_date <= now,
+        or_(ProductORM.expired == 0, ProductORM.expired.is_(None)),
+    ).all()
+    for product in products:
+        product.expired = 1
+    db.flush()
+    for product in products:
+        record_change(db, "products", "update", product.id, Product.model_validate(product).model_dump(mode="json"))
+    return len(products)
+
+
+def purge_idempotency_keys(db: Session) -> int:
+    return purge_expired_keys(db)
+
+
+def compact_change_events(db: Session) -> int:
+    return compact_changes(db)
+
+
+def evict_idle_tenant_engines(db: Session) -> int:
+    if not database.tenancy_enabled():
+        return 0
+    return tenancy.registry.evict_idle()
+
+
+def _is_sqlite(db: Session) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def sqlite_checkpoint(db: Session) -> str:
+    if not _is_sqlite(db):
+        return "ignorado"
+    row = db.execute(text("PRAGMA wal_checkpoint(TRUNCATE)")).first()
+    return str(tuple(row)) if row else ""
+
+
+def sqlite_analyze(db: Session) -> str:
+    if not _is_sqlite(db):
+        return "ignorado"
+    db.execute(text("ANALYZE"))
+    return "ok"
+
+
+def sqlite_vacuum(db: Session) -> str:
+    if not _is_sqlite(db):
+        return "ignorado"
+    # VACUUM não pode rodar dentro de uma transação
+    with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+    return "ok"
+
+
+class LeadershipLost(Exception):
+    """
+    O lease expirou ou foi tomado por outro processo durante a execução dos jobs.
+    """
+
+
+@dataclass
+class Job:
+    name: str
+    interval_seconds: float
+    func: Callable[[Session], Any]
+    # Jobs por tenant rodam no banco principal e em cada tenant provisionado
+    per_tenant: bool = True
+
+
+DEFAULT_JOBS = [
+    Job("expire_products", 5 * 60, expire_products),
+    Job("purge_idempotency_keys", 10 * 60, purge_idempotency_keys, per_tenant=False),
+    Job("compact_change_events", 15 * 60, compact_change_events),
+    Job("sqlite_checkpoint", 5 * 60, sqlite_checkpoint),
+    Job("sqlite_analyze", 6 * 60 * 60, sqlite_analyze),
+    Job("sqlite_vacuum", 24 * 60 * 60, sqlite_vacuum),
+    Job("evict_idle_tenant_engines", 60, evict_idle_tenant_engines, per_tenant=False),
+]
+
+
+class Scheduler:
+    """
+    Agendador asyncio executado dentro do processo da API.
+    Com vários workers, apenas o que detém o lock (linha em scheduler_lock)
+    executa os jobs; o lock é renovado a cada tick e antes de cada job/tenant,
+    e expira se o líder cair.
+    """
+
+    def __init__(self, jobs: list[Job] | None = None, lease_seconds: float = SCHEDULER_LEASE_SECONDS):
+        self.jobs = {job.name: Job(job.name, job.interval_seconds, job.func, job.per_tenant) for job in (DEFAULT_JOBS if jobs is None else jobs)}
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._task: asyncio.Task | None = None
+
+    def acquire_leadership(self) -> bool:
+        db = database.SessionLocal()
+        try:
+            now = _utcnow()
+            expires_at = now + timedelta(seconds=self.lease_seconds)
+            updated = db.query(SchedulerLockORM).filter(
+                SchedulerLockORM.name == SCHEDULER_LOCK_NAME,
+                or_(SchedulerLockORM.owner == self.owner, SchedulerLockORM.expires_at < now),
+            ).update({SchedulerLockORM.owner: self.owner, SchedulerLockORM.expires_at: expires_at}, synchronize_session=False)
+            if not updated:
+                db.add(SchedulerLockORM(name=SCHEDULER_LOCK_NAME, owner=self.owner, expires_at=expires_at))
+            db.commit()
+            self.is_leader = True
+        except IntegrityError:
+            db.rollback()
+            self.is_leader = False
+        finally:
+            db.close()
+        return self.is_leader
+
+    def release_leadership(self) -> None:
+        db = database.SessionLocal()
+        try:
+            db.query(SchedulerLockORM).filter_by(name=SCHEDULER_LOCK_NAME, owner=self.owner).delete()
+            db.commit()
+        finally:
+            db.close()
+        self.is_leader = False
+
+    def renew_leadership(self) -> None:
+        """
+        Renova o lease; se não conseguir, interrompe a execução com LeadershipLost
+        para que dois processos nunca rodem os mesmos jobs ao mesmo tempo.
+        """
+        try:
+            renewed = self.acquire_leadership()
+        except SQLAlchemyError as exc:
+            logger.error(f"Agendador não conseguiu renovar o lock: {exc}")
+            renewed = False
+        if not renewed:
+            raise LeadershipLost()
+
+    def run_job(self, job: Job) -> None:
+        started_at = _utcnow()
+        start = time.perf_counter()
+        targets = database.maintenance_sessions() if job.per_tenant else [("default", database.SessionLocal)]
+        results, errors = {}, []
+        for target, session_factory in targets:
+            # Jobs em muitos tenants podem passar do lease: renova antes de cada um
+            self.renew_leadership()
+            db = None
+            try:
+                db = session_factory()
+                results[target] = job.func(db)
+                db.commit()
+            except Exception as exc:
+                if db is not None:
+                    db.rollback()
+                errors.append(f"{target}: {type(exc).__name__}: {exc}")
+                logger.error(f"Job {job.name} falhou em {target}: {exc}")
+            finally:
+                if db is not None:
+                    db.close()
+        result = results.get("default") if len(results) == 1 else results
+        error = "; ".join(errors) or None
+        duration_ms = (time.perf_counter() - start) * 1000
+        try:
+            self._record_run(job.name, started_at, duration_ms, result, error)
+        except Exception as exc:
+            # Sem o registro, o job continua vencido e roda de novo no próximo tick
+            logger.error(f"Agendador não conseguiu registrar a execução de {job.name}: {exc}")
+        # Escritas dos jobs também contam para o atraso medido nas réplicas
+        database.write_heartbeat(force=True)
+
+    def _record_run(self, name: str, started_at: datetime, duration_ms: float, result: Any, error: str | None) -> None:
+        db = database.SessionLocal()
+        try:
+            record = db.get(ScheduledJobORM, name) or ScheduledJobORM(name=name, runs=0, failures=0)
+            record.runs += 1
+            record.last_started_at = started_at
+            record.last_duration_ms = duration_ms
+            if error:
+                record.failures += 1
+                record.last_error = error
+            else:
+                record.last_success_at = _utcnow()
+                record.last_result = None if result is None else str(result)
+            db.add(record)
+            db.commit()
+        finally:
+            db.close()
+
+    def due_jobs(self) -> list[Job]:
+        """
+        Jobs cujo intervalo já passou desde a última execução registrada em
+        scheduled_jobs; reinícios e trocas de líder não antecipam as execuções.
+        """
+        db = database.SessionLocal()
+        try:
+            last_started = dict(db.query(ScheduledJobORM.name, ScheduledJobORM.last_started_at).all())
+        finally:
+            db.close()
+        now = _utcnow()
+        return [
+            job for job in self.jobs.values()
+            if last_started.get(job.name) is None
+            or now - last_started[job.name] >= timedelta(seconds=job.interval_seconds)
+        ]
+
+    def tick(self) -> list[str]:
+        """
+        Renova a liderança e executa os jobs vencidos. Retorna os nomes executados.
+        """
+        try:
+            if not self.acquire_leadership():
+                return []
+        except SQLAlchemyError as exc:
+            logger.error(f"Agendador não conseguiu obter o lock: {exc}")
+            return []
+        executed = []
+        for job in self.due_jobs():
+            try:
+                self.run_job(job)
+            except LeadershipLost:
+                # Execução incompleta não é registrada: o novo líder roda o job de novo
+                logger.error(f"Agendador perdeu a liderança durante o job {job.name}; execução interrompida")
+                break
+            executed.append(job.name)
+        return executed
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await run_in_threadpool(self.tick)
+            except Exception as exc:
+                # Erros transitórios (ex.: "database is locked") não podem encerrar o agendador
+                logger.error(f"Agendador falhou no tick: {type(exc).__name__}: {exc}")
+            await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await run_in_threadpool(self.release_leadership)
+
+    def status(self, db: Session) -> dict:
+        lock = db.get(SchedulerLockORM, SCHEDULER_LOCK_NAME)
+        leader = lock.owner if lock and lock.expires_at > _utcnow() else None
+        records = {r.name: r for r in db.query(ScheduledJobORM).all()}
+        jobs = []
+        for job in self.jobs.values():
+            record = records.get(job.name)
+            jobs.append({
+                "name": job.name,
+                "interval_seconds": job.interval_seconds,
+                "runs": record.runs if record else 0,
+                "failures": record.failures if record else 0,
+                "last_started_at": record.last_started_at if record else None,
+                "last_success_at": record.last_success_at if record else None,
+                "last_duration_ms": record.last_duration_ms if record else None,
+                "last_result": record.last_result if record else None,
+                "last_error": record.last_error if record else None,
+            })
+        return {"leader": leader, "is_leader": leader == self.owner, "jobs": jobs}
+
+
+scheduler = Scheduler()
@@ -0,0 +1,251 @@
+import argparse
+import getpass
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from fastapi import HTTPException, Request
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+
+from desafio_lu_estilo.database import Base
+from desafio_lu_estilo.models import UserCreate, UserORM  # também registra as tabelas em Base.metadata
+
+# Configurações
+TENANT_DB_DIR = Path(os.getenv("TENANT_DB_DIR", "tenants"))
+# Máximo de engines abertas ao mesmo tempo (LRU)
+TENANT_MAX_ENGINES = int(os.getenv("TENANT_MAX_ENGINES", "256"))
+# Engines sem uso por este tempo são fechadas pelo agendador
+TENANT_ENGINE_IDLE_SECONDS = int(os.getenv("TENANT_ENGINE_IDLE_SECONDS", str(10 * 60)))
+# Conexões mantidas por tenant; picos usam conexões extras que são fechadas em seguida
+TENANT_POOL_SIZE = 1
+TENANT_MAX_OVERFLOW = 4
+
+# Tabelas de controle vivem só no banco principal (idempotência, agendador, heartbeat de réplicas)
+CONTROL_TABLES = {"idempotency_keys", "scheduler_lock", "scheduled_jobs", "replication_heartbeat"}
+
+TENANT_HEADER = "X-Tenant-ID"
+TENANT_CLAIM = "tenant"
+_TENANT_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+
+def validate_tenant_id(tenant: str) -> str:
+    if not _TENANT_ID.match(tenant):
+        raise HTTPException(status_code=400, detail="Tenant inválido")
+    return tenant
+
+
+def tenant_from_request(request: Request) -> str | None:
+    """
+    Resolve o tenant da requisição. Com token, vale apenas a claim `tenant` do JWT
+    (token inválido ou sem a claim é rejeitado com 401); sem token (login),
+    usa o header X-Tenant-ID.
+    O resultado fica em request.state para não decodificar o token duas vezes.
+    """
+    if hasattr(request.state, "tenant"):
+        return request.state.tenant
+
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        from jose import jwt, JWTError
+        from desafio_lu_estilo.auth import SECRET_KEY, ALGORITHM
+        try:
+            tenant = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM]).get(TENANT_CLAIM)
+        except JWTError:
+            raise HTTPException(status_code=401, detail="Token inválido")
+        if not tenant:
+            raise HTTPException(status_code=401, detail="Token sem loja")
+    else:
+        tenant = request.headers.get(TENANT_HEADER)
+
+    request.state.tenant = validate_tenant_id(tenant) if tenant else None
+    return request.state.tenant
+
+
+@dataclass
+class _TenantEngine:
+    engine: Engine
+    session_factory: sessionmaker
+    last_used: float
+
+
+class TenantEngineRegistry:
+    """
+    Mantém uma engine SQLite por tenant (um arquivo por loja), com LRU
+    limitado a `max_engines` e fechamento das engines ociosas.
+    Só abre tenants já provisionados; arquivos novos são criados por `provision`.
+    """
+
+    def __init__(self, base_dir: Path = TENANT_DB_DIR, max_engines: int = TENANT_MAX_ENGINES, idle_seconds: float = TENANT_ENGINE_IDLE_SECONDS):
+        self.base_dir = Path(base_dir)
+        self.max_engines = max_engines
+        self.idle_seconds = idle_seconds
+        self._engines: OrderedDict[str, _TenantEngine] = OrderedDict()
+        self._lock = threading.Lock()
+        self._provision_lock = threading.Lock()
+
+    def path_for(self, tenant: str) -> Path:
+        return self.base_dir / f"{tenant}.db"
+
+    def url_for(self, tenant: str) -> str:
+        return f"sqlite:///{self.path_for(tenant)}"
+
+    def exists(self, tenant: str) -> bool:
+        return self.path_for(tenant).is_file()
+
+    def provision(self, tenant: str, initialize: Callable[[Session], None] | None = None) -> bool:
+        """
+        Cria o arquivo do tenant com as tabelas de dados da loja. `initialize` recebe uma sessão
+        no banco novo (ex.: para criar o administrador) antes de ele ficar visível.
+        Retorna False se o tenant já existe.
+        """
+        validate_tenant_id(tenant)
+        path = self.path_for(tenant)
+        with self._provision_lock:
+            if path.exists():
+                return False
+            self.base_dir.mkdir(parents=True, exist_ok=True)
+            # O schema é criado num arquivo temporário e publicado de forma atômica:
+            # requisições concorrentes nunca veem um tenant pela metade
+            fd, tmp = tempfile.mkstemp(dir=self.base_dir, prefix=f".{tenant}-", suffix=".tmp")
+            os.close(fd)
+            try:
+                engine = create_engine(f"sqlite:///{tmp}")
+                try:
+                    tables = [t for t in Base.metadata.sorted_tables if t.name not in CONTROL_TABLES]
+                    Base.metadata.create_all(bind=engine, tables=tables)
+                    if initialize is not None:
+                        with sessionmaker(bind=engine)() as db:
+                            initialize(db)
+                            db.commit()
+                finally:
+                    engine.dispose()
+                try:
+                    # link não sobrescreve: outro processo pode ter provisionado o mesmo tenant
+                    os.link(tmp, path)
+                except FileExistsError:
+                    return False
+                return True
+            finally:
+                os.unlink(tmp)
+
+    def tenants(self) -> list[str]:
+        """
+        Todos os tenants provisionados (arquivos em `base_dir`), abertos ou não neste processo.
+        """
+        if not self.base_dir.is_dir():
+            return []
+        return sorted(path.stem for path in self.base_dir.glob("*.db") if _TENANT_ID.match(path.stem))
+
+    def maintenance_session_factory(self, tenant: str) -> sessionmaker:
+        """
+        Sessões para os jobs do agendador, fora do LRU: cada conexão é fechada junto com
+        a sessão, então tenants ociosos não ficam abertos nem têm o uso renovado.
+        """
+        engine = create_engine(self.url_for(tenant), poolclass=NullPool)
+        return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def _open(self, tenant: str) -> _TenantEngine:
+        if not self.exists(tenant):
+            raise HTTPException(status_code=404, detail="Tenant não encontrado")
+        engine = create_engine(
+            self.url_for(tenant),
+            connect_args={"check_same_thread": False},
+            pool_size=TENANT_POOL_SIZE,
+            max_overflow=TENANT_MAX_OVERFLOW,
+        )
+        return _TenantEngine(engine, sessionmaker(autocommit=False, autoflush=False, bind=engine), time.monotonic())
+
+    def session_factory(self, tenant: str) -> sessionmaker:
+        validate_tenant_id(tenant)
+        with self._lock:
+            entry = self._engines.get(tenant)
+            if entry is not None:
+                self._engines.move_to_end(tenant)
+                entry.last_used = time.monotonic()
+                return entry.session_factory
+        # Abertura fora do lock: não bloqueia os outros tenants
+        entry = self._open(tenant)
+        evicted = []
+        with self._lock:
+            current = self._engines.get(tenant)
+            if current is not None:
+                evicted.append(entry)
+                entry = current
+            else:
+                self._engines[tenant] = entry
+            self._engines.move_to_end(tenant)
+            while len(self._engines) > self.max_engines:
+                evicted.append(self._engines.popitem(last=False)[1])
+        for old in evicted:
+            old.engine.dispose()
+        return entry.session_factory
+
+    def session(self, tenant: str) -> Session:
+        return self.session_factory(tenant)()
+
+    def evict_idle(self) -> int:
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [tenant for tenant, entry in self._engines.items() if entry.last_used < cutoff]
+            evicted = [self._engines.pop(tenant) for tenant in idle]
+        for entry in evicted:
+            entry.engine.dispose()
+        return len(evicted)
+
+    def open_session_factories(self) -> list[tuple[str, sessionmaker]]:
+        # Não atualiza last_used: inspecionar o LRU não deve manter tenants ociosos abertos
+        with self._lock:
+            return [(tenant, entry.session_factory) for tenant, entry in self._engines.items()]
+
+    def dispose_all(self) -> None:
+        with self._lock:
+            evicted = list(self._engines.values())
+            self._engines.clear()
+        for entry in evicted:
+            entry.engine.dispose()
+
+
+registry = TenantEngineRegistry()
+
+
+def provision_tenant(tenant: str, username: str, email: str, password: str) -> bool:
+    """
+    Provisiona uma loja com o seu administrador inicial. Retorna False se ela já existe.
+    """
+    from desafio_lu_estilo.auth import get_password_hash
+
+    admin = UserCreate(username=username, email=email, password=password, is_admin=True)
+
+    def create_admin(db: Session) -> None:
+        db.add(UserORM(username=admin.username, email=admin.email, hashed_password=get_password_hash(admin.password), is_admin=1))
+
+    return registry.provision(tenant, create_admin)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Cria o banco de uma nova loja com o administrador inicial.")
+    parser.add_argument("tenant", help="Identificador da loja (ex.: loja-centro)")
+    parser.add_argument("--admin", required=True, help="Usuário administrador")
+    parser.add_argument("--email", required=True, help="E-mail do administrador")
+    args = parser.parse_args(argv)
+    try:
+        created = provision_tenant(args.tenant, args.admin, args.email, getpass.getpass("Senha do administrador: "))
+    except HTTPException as exc:
+        sys.exit(exc.detail)
+    if not created:
+        sys.exit(f"Tenant {args.tenant} já existe")
+    print(f"Tenant {args.tenant} criado em {registry.path_for(args.tenant)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -38,6 +38,13 @@ def get_token():
     assert response.status_code == 200
     return response.json()["access_token"]
 
+# ------------------------ CPF ------------------------
+def generate_cpf():
+    digits = [int(d) for d in str(uuid.uuid4().int % 10**9).zfill(9)]
+    for size in (9, 10):
+        digits.append(sum(d * w for d, w in zip(digits, range(size + 1, 1, -1))) * 10 % 11 % 10)
+    return "".join(map(str, digits))
+
 # ------------------------ AUTH ------------------------
 def test_register_user():
     response = client.post("/auth/register", json={
@@ -64,7 +71,7 @@ def test_create_client():
     response = client.post("/clients/", json={
         "name": "Cliente Teste",
         "email": f"{uuid.uuid4().hex[:8]}@email.com",
-        "cpf": str(int(uuid.uuid4().int) % 10**11).zfill(11)
+        "cpf": generate_cpf()
     }, headers=headers)
     assert response.status_code == 200
 
@@ -80,7 +87,7 @@ def test_update_client():
     response = client.post("/clients/", json={
         "name": "Cliente Update",
         "email": f"{uuid.uuid4().hex[:8]}@email.com",
-        "cpf": str(int(uuid.uuid4().int) % 10**11).zfill(11)
+        "cpf": generate_cpf()
     }, headers=headers)
     client_id = response.json()["id"]
     update = client.put(f"/clients/{client_id}", json={"name": "Atualizado"}, headers=headers)
@@ -93,7 +100,7 @@ def test_delete_client():
     response = client.post("/clients/", json={
         "name": "Cliente Delete",
         "email": f"{uuid.uuid4().hex[:8]}@email.com",
-        "cpf": str(int(uuid.uuid4().int) % 10**11).zfill(11)
+        "cpf": generate_cpf()
     }, headers=headers)
     client_id = response.json()["id"]
     delete = client.delete(f"/clients/{client_id}", headers=headers)
@@ -158,7 +165,7 @@ def test_create_order_with_insufficient_stock():
     client_resp = client.post("/clients/", json={
         "name": "Cliente Estoque",
         "email": f"{uuid.uuid4().hex[:8]}@email.com",
-        "cpf": str(int(uuid.uuid4().int) % 10**11).zfill(11)
+        "cpf": generate_cpf()
     }, headers=headers)
     client_id = client_resp.json()["id"]
 
@@ -188,7 +195,7 @@ def test_filter_orders_by_status():
     client_id = client.post("/clients/", json={
         "name": "Cliente Teste",
         "email": f"{uuid.uuid4().hex[:8]}@email.com",
-        "cpf": str(int(uuid.uuid4().int) % 10**11).zfill(11)
+        "cpf": generate_cpf()
     }, headers=headers).json()["id"]
 
     product_id = client.post("/products/", json={
@@ -218,7 +225,7 @@ def test_filter_orders_by_date_range():
     client_id = client.post("/clients/", json={
         "name": "Cliente Data",
         "email": f"{uuid.uuid4().hex[:8]}@email.com",
-        "cpf": str(int(uuid.uuid4().int) % 10**11).zfill(11)
+        "cpf": generate_cpf()
     }, headers=headers).json()["id"]
 
     product_id = client.post("/products/", json={
@@ -248,7 +255,7 @@ def test_filter_orders_by_product_section():
     client_id = client.post("/clients/", json={
         "name": "Cliente Seção",
         "email": f"{uuid.uuid4().hex[:8]}@email.com",
-        "cpf": str(int(uuid.uuid4().int) % 10**11).zfill(11)
+        "cpf": generate_cpf()
     }, headers=headers).json()["id"]
 
     product_id = client.post("/products/", json={
@@ -286,4 +293,874 @@ def test_create_product_with_image_url():
     }, headers=headers)
 
     assert response.status_code == 200
-    assert response.json()["image_url"] == image_url
\ No newline at end of file
+    assert response.json()["image_url"] == image_url
+# ------------------------ IDEMPOTÊNCIA ------------------------
+def test_idempotent_parallel_orders_execute_once():
+    from concurrent.futures import ThreadPoolExecutor
+
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client_id = client.post("/clients/", json={
+        "name": "Cliente Idempotente",
+        "email": f"{uuid.uuid4().hex[:8]}@email.com",
+        "cpf": generate_cpf()
+    }, headers=headers).json()["id"]
+
+    product_id = client.post("/products/", json={
+        "description": "Produto Idempotente",
+        "sale_price": 15.0,
+        "barcode": f"{uuid.uuid4().int % 1000000000000:013}",
+        "section": "Idempotencia",
+        "initial_stock": 10,
+        "expiration_date": None
+    }, headers=headers).json()["id"]
+
+    order_headers = {**headers, "Idempotency-Key": uuid.uuid4().hex}
+    payload = {"client_id": client_id, "status": "idempotente", "products": [product_id]}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: client.post("/orders/", json=payload, headers=order_headers), range(8)))
+
+    assert all(r.status_code == 200 for r in responses)
+    assert len({r.json()["id"] for r in responses}) == 1
+
+    orders = client.get(f"/orders/?client_id={client_id}", headers=headers).json()
+    assert len(orders) == 1
+
+    product = client.get(f"/products/{product_id}", headers=headers).json()
+    assert product["initial_stock"] == 9
+
+def test_idempotent_replay_returns_stored_response():
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": uuid.uuid4().hex}
+    payload = {
+        "name": "Cliente Replay",
+        "email": f"{uuid.uuid4().hex[:8]}@email.com",
+        "cpf": generate_cpf()
+    }
+
+    first = client.post("/clients/", json=payload, headers=headers)
+    second = client.post("/clients/", json=payload, headers=headers)
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+def test_idempotency_key_reused_with_different_payload():
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": uuid.uuid4().hex}
+    product = {
+        "description": "Produto Chave",
+        "sale_price": 10.0,
+        "barcode": f"{uuid.uuid4().int % 1000000000000:013}",
+        "section": "Idempotencia",
+        "initial_stock": 1,
+        "expiration_date": None
+    }
+
+    first = client.post("/products/", json=product, headers=headers)
+    other = client.post("/products/", json={**product, "description": "Outro Produto"}, headers=headers)
+
+    assert first.status_code == 200
+    assert other.status_code == 422
+
+def test_idempotency_key_is_not_replayed_to_other_users():
+    username = f"user_{uuid.uuid4().hex[:8]}"
+    client.post("/auth/register", json={"username": username, "email": f"{username}@email.com", "password": "senha123"})
+    other_token = client.post("/auth/login", data={"username": username, "password": "senha123"}).json()["access_token"]
+
+    key = uuid.uuid4().hex
+    payload = {
+        "name": "Cliente Outro Usuário",
+        "email": f"{uuid.uuid4().hex[:8]}@email.com",
+        "cpf": generate_cpf()
+    }
+    first = client.post("/clients/", json=payload, headers={"Authorization": f"Bearer {get_token()}", "Idempotency-Key": key})
+    assert first.status_code == 200
+
+    # Mesma chave e payload de outro usuário: executa de novo (e esbarra no CPF duplicado)
+    other = client.post("/clients/", json=payload, headers={"Authorization": f"Bearer {other_token}", "Idempotency-Key": key})
+    assert other.status_code == 400
+    assert "Idempotent-Replayed" not in other.headers
+
+def test_idempotency_key_requires_authentication():
+    key = uuid.uuid4().hex
+    payload = {
+        "name": "Cliente Sem Token",
+        "email": f"{uuid.uuid4().hex[:8]}@email.com",
+        "cpf": generate_cpf()
+    }
+
+    # A primeira tentativa sem token não reserva a chave
+    anonymous = client.post("/clients/", json=payload, headers={"Idempotency-Key": key})
+    assert anonymous.status_code == 401
+
+    headers = {"Authorization": f"Bearer {get_token()}", "Idempotency-Key": key}
+    created = client.post("/clients/", json=payload, headers=headers)
+    assert created.status_code == 200
+    assert "Idempotent-Replayed" not in created.headers
+
+    # A resposta armazenada não é devolvida sem autenticação
+    replay = client.post("/clients/", json=payload, headers={"Idempotency-Key": key})
+    assert replay.status_code == 401
+    assert "Idempotent-Replayed" not in replay.headers
+
+# ------------------------ RÉPLICAS DE LEITURA ------------------------
+def _write_primary_heartbeat(updated_at):
+    from desafio_lu_estilo import database
+
+    with database.engine.begin() as conn:
+        conn.execute(database.replication_heartbeat.delete())
+        conn.execute(database.replication_heartbeat.insert().values(id=1, updated_at=updated_at))
+
+def _snapshot_primary(path):
+    import sqlite3
+    import time
+    from desafio_lu_estilo import database
+
+    _write_primary_heartbeat(time.time())
+    source = sqlite3.connect(database.engine.url.database)
+    target = sqlite3.connect(str(path))
+    source.backup(target)
+    source.close()
+    target.close()
+    return f"sqlite:///{path}"
+
+def test_get_routes_read_from_replica_with_stickiness(tmp_path):
+    from desafio_lu_estilo import database
+
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    database.configure_replicas([_snapshot_primary(tmp_path / "replica.db")], max_lag=60)
+    try:
+        product_id = client.post("/products/", json={
+            "description": "Produto Réplica",
+            "sale_price": 10.0,
+            "barcode": f"{uuid.uuid4().int % 1000000000000:013}",
+            "section": "Replica",
+            "initial_stock": 1,
+            "expiration_date": None
+        }, headers=headers).json()["id"]
+
+        # Logo após a escrita, o cookie de stickiness garante leitura do primário
+        assert client.get(f"/products/{product_id}", headers=headers).status_code == 200
+
+        # Sem o cookie, a leitura vai para a réplica, que ainda não tem o produto
+        fresh = TestClient(app)
+        assert fresh.get(f"/products/{product_id}", headers=headers).status_code == 404
+    finally:
+        database.configure_replicas([])
+
+def test_lagging_replica_is_skipped(tmp_path):
+    import time
+    from desafio_lu_estilo import database
+
+    picker = database.configure_replicas([_snapshot_primary(tmp_path / "replica.db")], max_lag=1)
+    try:
+        picker.refresh()
+        assert picker.pick() is not database.engine
+
+        with database.engine.begin() as conn:
+            conn.execute(database.replication_heartbeat.update().values(updated_at=time.time() + 10))
+        picker.refresh()
+        assert picker.pick() is database.engine
+    finally:
+        database.configure_replicas([])
+
+def test_heartbeat_written_only_with_replicas_and_by_scheduler(tmp_path):
+    from desafio_lu_estilo import database
+    from desafio_lu_estilo.scheduler import Job, Scheduler
+
+    _write_primary_heartbeat(0.0)
+    database.write_heartbeat(force=True)
+    assert database._read_heartbeat(database.engine) == 0.0
+
+    database.configure_replicas([_snapshot_primary(tmp_path / "replica.db")])
+    _write_primary_heartbeat(0.0)
+    scheduler = Scheduler(jobs=[Job(f"noop_{uuid.uuid4().hex[:6]}", 60, lambda db: None, per_tenant=False)])
+    try:
+        assert len(scheduler.tick()) == 1
+        assert database._read_heartbeat(database.engine) > 0
+    finally:
+        scheduler.release_leadership()
+        database.configure_replicas([])
+
+# ------------------------ IMAGENS ------------------------
+def _png_bytes(color=(200, 30, 90)):
+    from io import BytesIO
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new("RGB", (1200, 900), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def test_upload_product_image_and_serve_variants(tmp_path, monkeypatch):
+    from desafio_lu_estilo import images
+
+    monkeypatch.setattr(images, "MEDIA_DIR", tmp_path)
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    product_id = client.post("/products/", json={
+        "description": "Produto Foto",
+        "sale_price": 50.0,
+        "barcode": f"{uuid.uuid4().int % 1000000000000:013}",
+        "section": "Imagens",
+        "initial_stock": 2,
+        "expiration_date": None
+    }, headers=headers).json()["id"]
+
+    upload = client.post(f"/products/{product_id}/image", files={"file": ("foto.png", _png_bytes(), "image/png")}, headers=headers)
+    assert upload.status_code == 200
+    variants = upload.json()["image_variants"]
+    assert set(variants) == {"original", "thumb.webp", "thumb.jpg", "medium.webp", "medium.jpg"}
+    assert upload.json()["image_url"] == variants["original"]
+
+    thumb = client.get(variants["thumb.webp"])
+    assert thumb.status_code == 200
+    assert thumb.headers["content-type"] == "image/webp"
+    assert "immutable" in thumb.headers["cache-control"]
+
+    cached = client.get(variants["thumb.webp"], headers={"If-None-Match": thumb.headers["etag"]})
+    assert cached.status_code == 304
+
+    partial = client.get(variants["original"], headers={"Range": "bytes=0-7"})
+    assert partial.status_code == 206
+    assert partial.content == b"\x89PNG\r\n\x1a\n"
+    assert partial.headers["content-type"] == "image/png"
+
+    # O formato do original é gravado no upload e não é detectado a cada requisição
+    digest = variants["original"].split("/")[2]
+    assert images.media_type_path(digest).read_text() == "image/png"
+
+def test_upgrade_schema_adds_columns_to_existing_products_table(tmp_path):
+    from sqlalchemy import create_engine, inspect, text
+    from sqlalchemy.orm import Session
+    from desafio_lu_estilo.database import upgrade_schema
+    from desafio_lu_estilo.models import ProductORM
+
+    # Tabela criada pela versão anterior, sem image_hash/expired
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old_engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE products (id INTEGER PRIMARY KEY, description VARCHAR, sale_price FLOAT, barcode VARCHAR UNIQUE, "
+            "section VARCHAR, initial_stock INTEGER, expiration_date DATETIME, image_url VARCHAR)"
+        ))
+        conn.execute(text("INSERT INTO products (description, sale_price, barcode, section, initial_stock) VALUES ('Antigo', 1.0, '1', 'Geral', 1)"))
+
+    assert upgrade_schema(old_engine) == ["products.image_hash", "products.expired"]
+    assert upgrade_schema(old_engine) == []
+    assert "ix_products_expired" in {index["name"] for index in inspect(old_engine).get_indexes("products")}
+    with Session(old_engine) as db:
+        product = db.query(ProductORM).one()
+        assert product.expired == 0 and product.image_hash is None
+    old_engine.dispose()
+
+def test_failed_variant_generation_is_not_resubmitted(tmp_path, monkeypatch):
+    import hashlib
+    from desafio_lu_estilo import images
+
+    monkeypatch.setattr(images, "MEDIA_DIR", tmp_path)
+    # Original corrompido no armazenamento: a geração das variantes falha no pool
+    data = b"corrompido" + uuid.uuid4().bytes
+    digest = hashlib.sha256(data).hexdigest()
+    images._atomic_write(images.original_path(digest), data)
+
+    assert client.get(f"/media/{digest}/thumb.webp").status_code == 404
+    assert images.variants_failed(digest)
+
+    def no_pool():
+        raise AssertionError("geração reenviada ao pool")
+
+    monkeypatch.setattr(images, "get_pool", no_pool)
+    assert client.get(f"/media/{digest}/medium.jpg").status_code == 404
+
+def test_upload_invalid_image():
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    product_id = client.post("/products/", json={
+        "description": "Produto Foto Inválida",
+        "sale_price": 50.0,
+        "barcode": f"{uuid.uuid4().int % 1000000000000:013}",
+        "section": "Imagens",
+        "initial_stock": 2,
+        "expiration_date": None
+    }, headers=headers).json()["id"]
+
+    upload = client.post(f"/products/{product_id}/image", files={"file": ("foto.png", b"nao e imagem", "image/png")}, headers=headers)
+    assert upload.status_code == 400
+
+# ------------------------ IDENTIDADE ------------------------
+def test_cpf_validation_agrees_with_utils():
+    from fastapi import HTTPException
+    from desafio_lu_estilo.identity import is_valid_cpf, validate_cpf_batch
+    from desafio_lu_estilo.utils import validate_cpf
+
+    cpfs = ["529.982.247-25", "52998224725", "52998224724", "11111111111", "123"]
+    assert validate_cpf_batch(cpfs) == [True, True, False, False, False]
+    assert [is_valid_cpf(cpf) for cpf in cpfs] == [True, True, False, False, False]
+    assert validate_cpf("529.982.247-25") is True
+    with pytest.raises(HTTPException):
+        validate_cpf("52998224724")
+
+def test_create_client_normalizes_identity_and_lookup():
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    cpf = generate_cpf()
+    formatted = f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+    email = f"{uuid.uuid4().hex[:8]}@Email.COM"
+
+    response = client.post("/clients/", json={"name": "Cliente Lookup", "email": email, "cpf": formatted}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["cpf"] == cpf
+    assert response.json()["email"] == email.lower()
+
+    lookup = client.get(f"/clients/lookup?cpf={formatted}", headers=headers)
+    assert lookup.status_code == 200
+    assert lookup.json()["id"] == response.json()["id"]
+
+    duplicate = client.post("/clients/", json={"name": "Outro", "email": email.upper(), "cpf": generate_cpf()}, headers=headers)
+    assert duplicate.status_code == 400
+    assert duplicate.json()["detail"] == "Email já cadastrado"
+
+def test_upgrade_schema_lowercases_existing_client_emails(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from desafio_lu_estilo.database import upgrade_schema
+    from desafio_lu_estilo.identity import find_identity_conflict
+    from desafio_lu_estilo.models import ClientORM
+
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    upgrade_schema(old_engine)
+    with Session(old_engine) as db:
+        # Gravados por versões anteriores, sem normalização
+        db.add_all([
+            ClientORM(name="A", email="Foo@Email.com", cpf="52998224725"),
+            ClientORM(name="B", email="Bar@Email.com", cpf="11144477735"),
+            ClientORM(name="C", email="bar@email.com", cpf="39053344705"),
+        ])
+        db.commit()
+
+    upgrade_schema(old_engine)
+    with Session(old_engine) as db:
+        assert find_identity_conflict(db, None, "foo@email.com") == "email"
+        assert find_identity_conflict(db, None, "bar@email.com") == "email"
+        assert sorted(email for (email,) in db.query(ClientORM.email)) == ["Bar@Email.com", "bar@email.com", "foo@email.com"]
+    old_engine.dispose()
+
+def test_create_client_with_invalid_cpf():
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post("/clients/", json={
+        "name": "Cliente CPF Inválido",
+        "email": f"{uuid.uuid4().hex[:8]}@email.com",
+        "cpf": "52998224724"
+    }, headers=headers)
+    assert response.status_code == 422
+
+def test_lookup_client_not_found():
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get(f"/clients/lookup?cpf={generate_cpf()}", headers=headers).status_code == 404
+    assert client.get("/clients/lookup?cpf=123", headers=headers).status_code == 400
+
+# ------------------------ MUDANÇAS (CDC) ------------------------
+def test_changes_feed_records_writes_in_order():
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    since = 0
+    while True:
+        batch = client.get(f"/changes?since={since}&limit=1000", headers=headers).json()
+        if not batch["events"]:
+            break
+        since = batch["next_since"]
+
+    client_id = client.post("/clients/", json={
+        "name": "Cliente CDC",
+        "email": f"{uuid.uuid4().hex[:8]}@email.com",
+        "cpf": generate_cpf()
+    }, headers=headers).json()["id"]
+    product_id = client.post("/products/", json={
+        "description": "Produto CDC",
+        "sale_price": 12.0,
+        "barcode": f"{uuid.uuid4().int % 1000000000000:013}",
+        "section": "CDC",
+        "initial_stock": 3,
+        "expiration_date": None
+    }, headers=headers).json()["id"]
+    order_id = client.post("/orders/", json={"client_id": client_id, "status": "cdc", "products": [product_id]}, headers=headers).json()["id"]
+    client.delete(f"/orders/{order_id}", headers=headers)
+
+    batch = client.get(f"/changes?since={since}", headers=headers).json()
+    events = [(e["entity"], e["op"], e["entity_id"]) for e in batch["events"]]
+    assert events == [
+        ("clients", "create", client_id),
+        ("products", "create", product_id),
+        ("orders", "create", order_id),
+        ("products", "update", product_id),
+        ("orders", "delete", order_id),
+    ]
+    seqs = [e["seq"] for e in batch["events"]]
+    assert seqs == sorted(seqs)
+    assert batch["next_since"] == seqs[-1]
+    assert batch["events"][3]["payload"]["initial_stock"] == 2
+
+    orders_only = client.get(f"/changes?since={since}&entity=orders", headers=headers).json()
+    assert [e["op"] for e in orders_only["events"]] == ["create", "delete"]
+
+    empty = client.get(f"/changes?since={seqs[-1]}&timeout=0.2", headers=headers).json()
+    assert empty == {"events": [], "next_since": seqs[-1]}
+
+def test_concurrent_long_polls_do_not_exhaust_pool():
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from desafio_lu_estilo.database import engine as primary
+
+    headers = {"Authorization": f"Bearer {get_token()}"}
+    head = client.get("/changes?since=0&limit=1000", headers=headers).json()["next_since"]
+    while True:
+        batch = client.get(f"/changes?since={head}&limit=1000", headers=headers).json()
+        if not batch["events"]:
+            break
+        head = batch["next_since"]
+
+    polls = primary.pool.size() + primary.pool._max_overflow + 5
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=polls + 1) as executor:
+        futures = [executor.submit(client.get, f"/changes?since={head}&timeout=2", headers=headers) for _ in range(polls)]
+        time.sleep(0.5)
+        products = executor.submit(client.get, "/products/", headers=headers).result()
+        products_elapsed = time.monotonic() - start
+        responses = [future.result() for future in futures]
+
+    assert products.status_code == 200
+    assert products_elapsed < 2
+    assert all(r.status_code == 200 and r.json()["events"] == [] for r in responses)
+    assert time.monotonic() - start < 10
+
+def test_changes_feed_sse():
+    import json
+
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}", "Accept": "text/event-stream"}
+    product_id = client.post("/products/", json={
+        "description": "Produto SSE",
+        "sale_price": 12.0,
+        "barcode": f"{uuid.uuid4().int % 1000000000000:013}",
+        "section": "CDC",
+        "initial_stock": 3,
+        "expiration_date": None
+    }, headers={"Authorization": f"Bearer {token}"}).json()["id"]
+
+    response = client.get("/changes?since=0&limit=1000", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    data = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert any(e["entity"] == "products" and e["entity_id"] == product_id for e in data)
+
+def test_compact_changes_keeps_latest_event_per_entity():
+    from datetime import timedelta
+    from desafio_lu_estilo import changes
+    from desafio_lu_estilo.database import SessionLocal
+    from desafio_lu_estilo.models import ChangeEventORM
+
+    db = SessionLocal()
+    try:
+        old = changes._utcnow() - timedelta(seconds=changes.CHANGES_COMPACTION_AFTER_SECONDS + 60)
+        entity_id = uuid.uuid4().int % 10**9
+        for op in ("create", "update", "update"):
+            db.add(ChangeEventORM(entity="products", entity_id=entity_id, op=op, created_at=old))
+        db.commit()
+
+        changes.compact_changes(db)
+        db.commit()
+
+        remaining = db.query(ChangeEventORM).filter_by(entity="products", entity_id=entity_id).all()
+        assert len(remaining) == 1
+        assert remaining[0].op == "update"
+    finally:
+        db.close()
+
+def test_changes_feed_returns_gone_below_low_watermark():
+    from datetime import timedelta
+    from desafio_lu_estilo import changes
+    from desafio_lu_estilo.database import SessionLocal
+    from desafio_lu_estilo.models import ChangeEventORM, ChangeFeedStateORM
+
+    headers = {"Authorization": f"Bearer {get_token()}"}
+    db = SessionLocal()
+    try:
+        old = changes._utcnow() - timedelta(seconds=changes.CHANGES_RETENTION_SECONDS + 60)
+        expired = ChangeEventORM(entity="clients", entity_id=uuid.uuid4().int % 10**9, op="create", created_at=old)
+        db.add(expired)
+        db.commit()
+        seq = expired.seq
+
+        changes.compact_changes(db)
+        db.commit()
+        assert changes.low_watermark() >= seq
+
+        gone = client.get(f"/changes?since={seq - 1}", headers=headers)
+        assert gone.status_code == 410
+        watermark = int(gone.headers[changes.LOW_WATERMARK_HEADER])
+        assert watermark == changes.low_watermark()
+        sse = client.get(f"/changes?since={seq - 1}", headers={**headers, "Accept": "text/event-stream"})
+        assert sse.status_code == 410
+        assert client.get(f"/changes?since={watermark}", headers=headers).status_code == 200
+    finally:
+        db.query(ChangeFeedStateORM).update({ChangeFeedStateORM.low_watermark: 0})
+        db.commit()
+        db.close()
+
+def test_outbox_locks_feed_state_outside_sqlite(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from desafio_lu_estilo.changes import record_change
+    from desafio_lu_estilo.database import Base
+    from desafio_lu_estilo.models import ChangeFeedStateORM
+
+    outbox_engine = create_engine(f"sqlite:///{tmp_path / 'outbox.db'}")
+    Base.metadata.create_all(bind=outbox_engine)
+    with Session(outbox_engine) as db:
+        record_change(db, "clients", "create", 1)
+        db.commit()
+        assert db.get(ChangeFeedStateORM, 1) is None  # SQLite: escritor único, sem bloqueio
+
+    # Simula um banco com escritas concorrentes: a linha de estado é bloqueada (e criada) antes do evento
+    outbox_engine.dialect.name = "postgresql"
+    with Session(outbox_engine) as db:
+        record_change(db, "clients", "update", 1)
+        db.commit()
+        assert db.get(ChangeFeedStateORM, 1).low_watermark == 0
+    outbox_engine.dispose()
+
+# ------------------------ AGENDADOR ------------------------
+def test_scheduler_runs_maintenance_jobs_and_reports_status():
+    from desafio_lu_estilo.scheduler import Scheduler
+
+    token = get_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    product_id = client.post("/products/", json={
+        "description": "Produto Vencido",
+        "sale_price": 5.0,
+        "barcode": f"{uuid.uuid4().int % 1000000000000:013}",
+        "section": "Vencidos",
+        "initial_stock": 4,
+        "expiration_date": "2020-01-01T00:00:00"
+    }, headers=headers).json()["id"]
+
+    scheduler = Scheduler()
+    try:
+        executed = scheduler.tick()
+        assert "expire_products" in executed
+        assert "sqlite_vacuum" in executed
+        assert scheduler.tick() == []  # nenhum job vencido novamente
+    finally:
+        scheduler.release_leadership()
+
+    # Um novo processo (reinício ou troca de líder) segue o agendamento gravado no banco
+    restarted = Scheduler()
+    try:
+        assert restarted.tick() == []
+    finally:
+        restarted.release_leadership()
+
+    available = client.get("/products/?section=Vencidos&available=true&limit=100", headers=headers).json()
+    assert product_id not in [p["id"] for p in available]
+
+    status = client.get("/admin/jobs", headers=headers)
+    assert status.status_code == 200
+    jobs = {job["name"]: job for job in status.json()["jobs"]}
+    assert jobs["expire_products"]["runs"] >= 1
+    assert jobs["expire_products"]["last_duration_ms"] is not None
+    assert all(job["failures"] == 0 for job in jobs.values())
+
+def test_scheduler_leader_election():
+    from desafio_lu_estilo.scheduler import Scheduler
+
+    first, second = Scheduler(jobs=[]), Scheduler(jobs=[])
+    try:
+        assert first.acquire_leadership()
+        assert not second.acquire_leadership()
+        first.release_leadership()
+        assert second.acquire_leadership()
+    finally:
+        first.release_leadership()
+        second.release_leadership()
+
+def test_scheduler_stops_when_lease_is_lost():
+    from datetime import timedelta
+    from desafio_lu_estilo.database import SessionLocal
+    from desafio_lu_estilo.models import ScheduledJobORM, SchedulerLockORM
+    from desafio_lu_estilo.scheduler import SCHEDULER_LOCK_NAME, Job, Scheduler, _utcnow
+
+    def lose_lease(db):
+        # Simula outro worker assumindo o lock enquanto o job roda
+        db.query(SchedulerLockORM).filter_by(name=SCHEDULER_LOCK_NAME).update({
+            SchedulerLockORM.owner: "outro-worker",
+            SchedulerLockORM.expires_at: _utcnow() + timedelta(seconds=60),
+        })
+
+    first, second = f"lease_{uuid.uuid4().hex[:6]}", f"lease_{uuid.uuid4().hex[:6]}"
+    scheduler = Scheduler(jobs=[Job(first, 60, lose_lease), Job(second, 60, lambda db: None)])
+    db = SessionLocal()
+    try:
+        assert scheduler.tick() == [first]
+        assert db.get(ScheduledJobORM, second) is None
+    finally:
+        db.query(SchedulerLockORM).filter_by(name=SCHEDULER_LOCK_NAME).delete()
+        db.commit()
+        db.close()
+
+def test_scheduler_loop_survives_tick_errors(monkeypatch):
+    import asyncio
+    from sqlalchemy.exc import OperationalError
+    from desafio_lu_estilo import scheduler as scheduler_module
+    from desafio_lu_estilo.scheduler import Scheduler
+
+    monkeypatch.setattr(scheduler_module, "SCHEDULER_TICK_SECONDS", 0.01)
+    scheduler = Scheduler(jobs=[])
+    ticks = []
+
+    def flaky_tick():
+        ticks.append(1)
+        if len(ticks) == 1:
+            raise OperationalError("SELECT 1", {}, Exception("database is locked"))
+        return []
+
+    monkeypatch.setattr(scheduler, "tick", flaky_tick)
+
+    async def run():
+        scheduler.start()
+        await asyncio.sleep(0.2)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert len(ticks) > 1
+
+def test_scheduler_records_job_failures():
+    from desafio_lu_estilo.database import SessionLocal
+    from desafio_lu_estilo.scheduler import Job, Scheduler
+
+    def failing_job(db):
+        raise RuntimeError("falha simulada")
+
+    name = f"failing_{uuid.uuid4().hex[:6]}"
+    scheduler = Scheduler(jobs=[Job(name, 60, failing_job)])
+    try:
+        assert scheduler.tick() == [name]
+    finally:
+        scheduler.release_leadership()
+
+    db = SessionLocal()
+    try:
+        job = scheduler.status(db)["jobs"][0]
+    finally:
+        db.close()
+    assert job["failures"] == 1
+    assert "falha simulada" in job["last_error"]
+
+# ------------------------ MULTI-TENANT ------------------------
+def test_tenants_are_isolated_by_jwt_claim(tmp_path, monkeypatch):
+    from jose import jwt
+    from desafio_lu_estilo import database, tenancy
+    from desafio_lu_estilo.auth import SECRET_KEY, ALGORITHM
+
+    monkeypatch.setattr(database, "TENANCY_MODE", "database")
+    monkeypatch.setattr(tenancy, "registry", tenancy.TenantEngineRegistry(tmp_path))
+    tenant_client = TestClient(app)
+
+    def tenant_headers(tenant):
+        assert tenancy.provision_tenant(tenant, "gerente", f"gerente@{tenant}.com", "senha123")
+        login = tenant_client.post("/auth/login", data={"username": "gerente", "password": "senha123"}, headers={"X-Tenant-ID": tenant})
+        assert login.status_code == 200
+        token = login.json()["access_token"]
+        assert jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["tenant"] == tenant
+        return {"Authorization": f"Bearer {token}"}
+
+    headers_a, headers_b = tenant_headers("loja-a"), tenant_headers("loja-b")
+    product = tenant_client.post("/products/", json={
+        "description": "Produto Loja A",
+        "sale_price": 10.0,
+        "barcode": "7890000000001",
+        "section": "Tenant",
+        "initial_stock": 1,
+        "expiration_date": None
+    }, headers=headers_a)
+    assert product.status_code == 200
+
+    assert [p["description"] for p in tenant_client.get("/products/", headers=headers_a).json()] == ["Produto Loja A"]
+    assert tenant_client.get("/products/", headers=headers_b).json() == []
+    # A claim do token prevalece sobre o header
+    assert tenant_client.get("/products/", headers={**headers_b, "X-Tenant-ID": "loja-a"}).json() == []
+    assert (tmp_path / "loja-a.db").exists() and (tmp_path / "loja-b.db").exists()
+
+    # Token sem a claim tenant não pode escolher a loja pelo header
+    from desafio_lu_estilo.auth import create_access_token
+    no_claim = {"Authorization": f"Bearer {create_access_token({'sub': 'gerente'})}", "X-Tenant-ID": "loja-a"}
+    assert tenant_client.get("/products/", headers=no_claim).status_code == 401
+    assert tenant_client.post("/auth/register", json={
+        "username": "intruso",
+        "email": "intruso@email.com",
+        "password": "senha123",
+        "is_admin": True
+    }, headers=no_claim).status_code == 401
+    assert tenant_client.get("/products/", headers={"Authorization": "Bearer invalido", "X-Tenant-ID": "loja-a"}).status_code == 401
+
+    assert tenant_client.post("/auth/login", data={"username": "gerente", "password": "senha123"}).status_code == 400
+    assert tenant_client.post("/auth/login", data={"username": "gerente", "password": "senha123"}, headers={"X-Tenant-ID": "../x"}).status_code == 400
+    tenancy.registry.dispose_all()
+
+def test_tenant_engine_registry_lru_and_idle_eviction(tmp_path):
+    from desafio_lu_estilo.tenancy import TenantEngineRegistry
+
+    registry = TenantEngineRegistry(tmp_path, max_engines=2, idle_seconds=3600)
+    for tenant in ("a", "b", "c"):
+        registry.provision(tenant)
+    for tenant in ("a", "b", "a", "c"):
+        registry.session(tenant).close()
+    assert [tenant for tenant, _ in registry.open_session_factories()] == ["a", "c"]
+
+    registry.idle_seconds = 0
+    assert registry.evict_idle() == 2
+    assert registry.open_session_factories() == []
+
+def test_provisioned_tenant_has_no_control_tables(tmp_path):
+    from sqlalchemy import create_engine, inspect
+    from desafio_lu_estilo.scheduler import DEFAULT_JOBS
+    from desafio_lu_estilo.tenancy import CONTROL_TABLES, TenantEngineRegistry
+
+    registry = TenantEngineRegistry(tmp_path)
+    assert registry.provision("loja-tabelas")
+    engine = create_engine(registry.url_for("loja-tabelas"))
+    try:
+        tables = set(inspect(engine).get_table_names())
+    finally:
+        engine.dispose()
+    assert {"products", "clients", "users", "change_events"} <= tables
+    assert not tables & CONTROL_TABLES
+    assert not next(job for job in DEFAULT_JOBS if job.name == "purge_idempotency_keys").per_tenant
+
+
+def test_unknown_tenant_is_not_created_on_request(tmp_path, monkeypatch):
+    from desafio_lu_estilo import database, tenancy
+
+    monkeypatch.setattr(database, "TENANCY_MODE", "database")
+    monkeypatch.setattr(tenancy, "registry", tenancy.TenantEngineRegistry(tmp_path))
+    tenant_client = TestClient(app)
+
+    for i in range(5):
+        login = tenant_client.post("/auth/login", data={"username": "x", "password": "y"}, headers={"X-Tenant-ID": f"nova-{i}"})
+        assert login.status_code == 404
+    register = tenant_client.post("/auth/register", json={
+        "username": "intruso",
+        "email": "intruso@email.com",
+        "password": "senha123",
+        "is_admin": True
+    }, headers={"X-Tenant-ID": "nova-0"})
+    assert register.status_code == 404
+    assert list(tmp_path.iterdir()) == []
+
+def test_tenant_register_requires_store_admin(tmp_path, monkeypatch):
+    from desafio_lu_estilo import database, tenancy
+
+    monkeypatch.setattr(database, "TENANCY_MODE", "database")
+    monkeypatch.setattr(tenancy, "registry", tenancy.TenantEngineRegistry(tmp_path))
+    tenant_client = TestClient(app)
+    assert tenancy.provision_tenant("loja-admin", "gerente", "gerente@loja.com", "senha123")
+    assert not tenancy.provision_tenant("loja-admin", "outro", "outro@loja.com", "senha123")
+
+    def register(username, headers):
+        return tenant_client.post("/auth/register", json={
+            "username": username,
+            "email": f"{username}@loja.com",
+            "password": "senha123"
+        }, headers={"X-Tenant-ID": "loja-admin", **headers})
+
+    def login(username):
+        token = tenant_client.post("/auth/login", data={"username": username, "password": "senha123"}, headers={"X-Tenant-ID": "loja-admin"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+
+    assert register("anonimo", {}).status_code == 401
+    assert register("vendedor", login("gerente")).status_code == 201
+    assert register("vendedor2", login("vendedor")).status_code == 403
+    tenancy.registry.dispose_all()
+
+def test_concurrent_first_requests_to_provisioned_tenant(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from desafio_lu_estilo.models import ProductORM
+    from desafio_lu_estilo.tenancy import TenantEngineRegistry
+
+    registry = TenantEngineRegistry(tmp_path)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        created = list(executor.map(lambda _: registry.provision("loja-nova"), range(8)))
+    assert created.count(True) == 1
+
+    def first_query(_):
+        db = registry.session("loja-nova")
+        try:
+            return db.query(ProductORM).count()
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(first_query, range(8))) == [0] * 8
+    assert [p.name for p in tmp_path.iterdir()] == ["loja-nova.db"]
+    registry.dispose_all()
+
+def test_per_tenant_jobs_cover_tenants_not_open_in_this_process(tmp_path, monkeypatch):
+    from datetime import datetime
+    from desafio_lu_estilo import database, tenancy
+    from desafio_lu_estilo.models import ProductORM
+    from desafio_lu_estilo.scheduler import Job, Scheduler, expire_products
+
+    monkeypatch.setattr(database, "TENANCY_MODE", "database")
+    monkeypatch.setattr(tenancy, "registry", tenancy.TenantEngineRegistry(tmp_path))
+    for tenant in ("loja-1", "loja-2"):
+        tenancy.registry.provision(tenant, lambda db: db.add(ProductORM(
+            description="Vencido", sale_price=1.0, barcode="1", section="Geral",
+            initial_stock=1, expiration_date=datetime(2020, 1, 1),
+        )))
+    assert tenancy.registry.open_session_factories() == []
+
+    assert [target for target, _ in database.maintenance_sessions()] == ["default", "loja-1", "loja-2"]
+    scheduler = Scheduler(jobs=[Job(f"expire_{uuid.uuid4().hex[:6]}", 60, expire_products)])
+    try:
+        assert len(scheduler.tick()) == 1
+    finally:
+        scheduler.release_leadership()
+
+    for tenant in ("loja-1", "loja-2"):
+        db = tenancy.registry.maintenance_session_factory(tenant)()
+        try:
+            assert db.query(ProductORM).one().expired == 1
+        finally:
+            db.close()
+    # Os jobs não abrem engines no LRU
+    assert tenancy.registry.open_session_factories() == []
+
+def test_admin_jobs_in_tenant_mode_reads_main_database(tmp_path, monkeypatch):
+    from desafio_lu_estilo import database, tenancy
+    from desafio_lu_estilo.scheduler import Scheduler
+
+    monkeypatch.setattr(database, "TENANCY_MODE", "database")
+    monkeypatch.setattr(tenancy, "registry", tenancy.TenantEngineRegistry(tmp_path))
+    tenant_client = TestClient(app)
+    assert tenancy.provision_tenant("loja-jobs", "gerente", "gerente@loja.com", "senha123")
+    login = tenant_client.post("/auth/login", data={"username": "gerente", "password": "senha123"}, headers={"X-Tenant-ID": "loja-jobs"})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    scheduler = Scheduler()
+    try:
+        scheduler.tick()
+        status = tenant_client.get("/admin/jobs", headers=headers)
+    finally:
+        scheduler.release_leadership()
+        tenancy.registry.dispose_all()
+    assert status.status_code == 200
+    assert status.json()["leader"] == scheduler.owner
+    jobs = {job["name"]: job for job in status.json()["jobs"]}
+    assert jobs["expire_products"]["runs"] >= 1
+    assert all(job["last_result"] is None and job["last_error"] is None for job in jobs.values())
@@ -0,0 +1,50 @@
+# tests/test_startup.py
+
+import os
+import subprocess
+import sys
+
+# Orçamento (ms) para o tempo próprio dos módulos do projeto durante o import de main
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "250"))
+
+# Dependências pesadas que só devem ser carregadas no primeiro uso
+LAZY_MODULES = {"passlib", "jose", "bcrypt", "PIL"}
+
+def _import_times(module: str) -> dict[str, tuple[int, int]]:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(p for p in sys.path if p)}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=os.getcwd(), check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+def test_main_import_does_not_load_heavy_dependencies():
+    times = _import_times("desafio_lu_estilo.main")
+    loaded = {name.split(".")[0] for name in times}
+    assert not LAZY_MODULES & loaded
+
+def test_main_import_time_budget():
+    times = _import_times("desafio_lu_estilo.main")
+    own_ms = sum(self_us for name, (self_us, _) in times.items() if name.startswith("desafio_lu_estilo")) / 1000
+    assert own_ms < IMPORT_TIME_BUDGET_MS, f"Import do projeto levou {own_ms:.1f} ms (orçamento: {IMPORT_TIME_BUDGET_MS} ms)"
+
+def test_main_import_has_no_side_effects(tmp_path):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(p for p in sys.path if p)}
+    subprocess.run([sys.executable, "-c", "import desafio_lu_estilo.main"], env=env, cwd=tmp_path, check=True)
+    assert list(tmp_path.iterdir()) == []
+
+def test_create_app_lifespan_initialises_logging(tmp_path):
+    from fastapi.testclient import TestClient
+    from desafio_lu_estilo.config import Settings
+    from desafio_lu_estilo.main import create_app
+
+    app = create_app(Settings(log_dir=str(tmp_path / "logs"), create_tables=False, scheduler_enabled=False))
+    with TestClient(app) as client:
+        assert client.get("/health").json() == {"status": "ok"}
+        assert (tmp_path / "logs" / "error.log").exists()
@@ -1,24 +1,16 @@
-import re
 from fastapi import HTTPException
 from pydantic import EmailStr
 
+from desafio_lu_estilo.identity import is_valid_cpf
+
 
 def validate_cpf(cpf: str) -> bool:
     """
     Valida um CPF no formato brasileiro.
     Retorna True se válido, senão levanta HTTPException.
     """
-    cpf = re.sub(r'\D', '', cpf)
-
-    if len(cpf) != 11 or cpf == cpf[0] * 11:
+    if not is_valid_cpf(cpf):
         raise HTTPException(status_code=400, detail="CPF inválido")
-
-    for i in range(9, 11):
-        value = sum((int(cpf[num]) * ((i + 1) - num) for num in range(0, i)))
-        digit = ((value * 10) % 11) % 10
-        if digit != int(cpf[i]):
-            raise HTTPException(status_code=400, detail="CPF inválido")
-
     return True
 
 